@@ -0,0 +1,105 @@
+# throughput of command.command() output decoding
+#
+#   python3 benchmark/command_decode.py [size(MB)]
+#
+# readline: the former implementation, readline() and trial decoding of
+#           every line with (preferred encoding, cp936, utf8)
+# decoder : command.decoder, 64K blocks through one incremental decoder
+
+import locale
+import os
+import os.path
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from pyant import command
+
+LINES = (
+    '[INFO] Compiling 128 source files to /build/U31R22_PLATFORM/code/platform/target/classes',
+    '[INFO] --- maven-compiler-plugin:3.1:compile (default-compile) @ platform-api ---',
+    '[ERROR] /build/U31R22_PLATFORM/code/platform/src/main/java/Main.java:[12,8] 找不到符号',
+    'Tests run: 12, Failures: 0, Errors: 0, Skipped: 0, Time elapsed: 0.52 sec - in com.zte.Test',
+    '[INFO] BUILD SUCCESS'
+)
+
+def readline(f):
+    count = 0
+
+    while True:
+        line = f.readline()
+
+        if not line:
+            break
+
+        for encoding in (locale.getpreferredencoding(False), 'cp936', 'utf8'):
+            try:
+                string = line.decode(encoding).rstrip()
+                count += 1
+
+                break
+            except:
+                pass
+
+    return count
+
+def decoder(f):
+    count = 0
+
+    stream = command.decoder()
+
+    while True:
+        data = f.read1(command.BLOCK_SIZE)
+
+        if not data:
+            count += len(stream.decode(b'', True))
+
+            break
+
+        count += len(stream.decode(data))
+
+    return count
+
+def main(size = 200):
+    block = ('\n'.join(LINES * 200) + '\n').encode('utf8')
+
+    with tempfile.NamedTemporaryFile(delete = False) as f:
+        for i in range(size * 1024 * 1024 // len(block) + 1):
+            f.write(block)
+
+        file = f.name
+
+    try:
+        mb = os.path.getsize(file) / 1024 / 1024
+
+        print('%.1f MB, preferred encoding: %s' % (mb, locale.getpreferredencoding(False)))
+
+        for name, function in (('readline', readline), ('decoder', decoder)):
+            with open(file, 'rb') as f:
+                t = time.time()
+                count = function(f)
+                t = time.time() - t
+
+            print('  %-10s: %10d lines, %6.2f s, %8.1f MB/s' % (name, count, t, mb / t))
+
+        cmd = command.command()
+
+        t = time.time()
+        count = 0
+
+        for line in cmd.command('cat "%s"' % file):
+            count += 1
+
+        t = time.time() - t
+
+        print('  %-10s: %10d lines, %6.2f s, %8.1f MB/s' % ('command', count - 2, t, mb / t))
+    finally:
+        os.remove(file)
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main()
@@ -4,14 +4,16 @@ import glob
 import os
 import os.path
 import re
+import shlex
 import shutil
+import subprocess
+import sys
 import tempfile
-import time
 import zipfile
 
 from lxml import etree
 
-from pyant import git
+from pyant import git, pom, scheduler
 from pyant.app import const, __build__
 from pyant.builtin import __os__, __string__
 
@@ -34,18 +36,13 @@ class build(__build__):
         self.type = 'ems'
         self.repos_devtools = const.SSH_GIT
 
-    def update(self, module, branch = None):
+    def update(self, module, branch = None, jobs = None):
         if module:
             if module in self.repos:
                 path = os.path.basename(self.repos[module])
 
                 if os.path.isdir(path):
-                    if os.path.isfile(os.path.join(path, '.git/index.lock')):
-                        time.sleep(30)
-
-                        return True
-                    else:
-                        return git.pull(path, revert = True)
+                    return git.pull(path, revert = True)
                 else:
                     return git.clone(self.repos[module], path, branch)
             elif module in ('devtools', ):
@@ -55,21 +52,19 @@ class build(__build__):
 
                 return False
         else:
-            status = True
+            repos = collections.OrderedDict()
 
-            for module in self.repos:
-                if not self.update(module, branch):
-                    status = False
+            for module, url in self.repos.items():
+                repos[module] = (url, os.path.basename(url))
 
-            if not self.update_devtools(branch):
-                status = False
+            repos['devtools'] = (self.url_devtools(), 'DEVTOOLS')
 
-            return status
+            return git.sync(repos, branch, jobs, True)
 
     def compile_pom(self, cmd = None, file = None):
         return super().compile_pom(cmd, 'U31R22_PLATFORM/pom/pom.xml')
 
-    def compile(self, module, cmd = None, clean = False, retry_cmd = None, dirname = None, lang = None):
+    def compile(self, module, cmd = None, clean = False, retry_cmd = None, dirname = None, lang = None, jobs = None):
         if module:
             if module in list(self.repos.keys()) + ['wdm1', 'wdm2', 'wdm3']:
                 self.environ(lang)
@@ -92,10 +87,36 @@ class build(__build__):
 
                 return False
         else:
+            # one pyant process per repository, maven changes the working
+            # directory of the whole process. a repository waits for the
+            # ones it depends on but is built (and mails its errors) even
+            # if they fail, as in the serial build. the metrics belong to
+            # this build, not to the per repository ones
+
+            sched = scheduler.scheduler(jobs)
+
+            for module, depends in self.compile_depends(dirname, lang).items():
+                args = [
+                    sys.executable, '-c', "import os, sys; os.environ['METRIC_IGNORE'] = '1'; from pyant import build; sys.exit(not build.build())",
+                    self.name, 'compile', os.getcwd(), module, cmd, clean, retry_cmd, dirname, lang
+                ]
+
+                args = ['_' if x is None else str(x) for x in args]
+
+                if os.name == 'nt':
+                    cmdline = subprocess.list2cmdline(args)
+                else:
+                    cmdline = ' '.join([shlex.quote(x) for x in args])
+
+                sched.add(module, cmdline, after = depends)
+
+            results = sched.run()
+            sched.puts_results(results)
+
             status = True
 
-            for module in self.repos:
-                if not self.compile(module, cmd, clean, retry_cmd, dirname, lang):
+            for result in results.values():
+                if not result or not result['status']:
                     status = False
 
             return status
@@ -194,6 +215,72 @@ class build(__build__):
 
         return False
 
+    # module -> modules to compile first
+    #
+    #   java : the modules providing artifacts of its reactor
+    #   cpp  : the modules exporting *_OUTPUT_HOME, see environ()
+    #
+    # only the modules before it in self.repos, the serial build order
+    def compile_depends(self, dirname = None, lang = None):
+        if lang in ('cpp', ):
+            if not dirname:
+                dirname = 'code_c/build'
+        else:
+            if not dirname:
+                dirname = 'code/build'
+
+        artifactids = collections.OrderedDict()
+
+        for module, url in self.repos.items():
+            if lang in ('cpp', ):
+                artifactids[module] = None
+            else:
+                artifactids[module] = pom.reactor(os.path.join(os.path.basename(url), dirname))
+
+        depends = collections.OrderedDict()
+
+        for module in self.repos:
+            depends[module] = []
+
+            if lang in ('cpp', ):
+                for name in self.repos:
+                    if name == module:
+                        break
+
+                    if name in ('interface', 'platform', 'necommon', 'e2e', 'uca', 'nbi', 'sdh', 'wdm'):
+                        depends[module].append(name)
+            else:
+                external = set()
+
+                for info in artifactids[module].values():
+                    external.update(info['dependencies'])
+
+                external -= set(artifactids[module].keys())
+
+                for name in self.repos:
+                    if name == module:
+                        break
+
+                    if external & set(artifactids[name].keys()):
+                        depends[module].append(name)
+
+        return depends
+
+    # repositories the one of self.path depends on, directly or not
+    def compile_upstream(self, dirname = None, lang = None):
+        depends = self.compile_depends(dirname, lang)
+
+        modules = [module for module, url in self.repos.items() if os.path.basename(url) == self.path]
+        upstream = set()
+
+        while modules:
+            for name in depends.get(modules.pop(), ()):
+                if name not in upstream:
+                    upstream.add(name)
+                    modules.append(name)
+
+        return [os.path.basename(url) for module, url in self.repos.items() if module in upstream]
+
     def environ(self, lang = None):
         if os.environ.get('UEP_VERSION'):
             if not os.environ.get('POM_UEP_VERSION'):
@@ -583,27 +670,24 @@ class build(__build__):
         return True
 
     def update_devtools(self, branch = None):
-        if __os__.osname() == 'linux':
-            url = __os__.join(self.repos_devtools, 'U31R22_DEVTOOLS_LINUX')
-        elif __os__.osname() == 'solaris':
-            url = __os__.join(self.repos_devtools, 'U31R22_DEVTOOLS_SOLARIS')
-        elif __os__.osname() == 'windows-x64':
-            url = __os__.join(self.repos_devtools, 'U31R22_DEVTOOLS_WINDOWS-x64')
-        else:
-            url = __os__.join(self.repos_devtools, 'U31R22_DEVTOOLS_WINDOWS')
-
+        url = self.url_devtools()
         path = 'DEVTOOLS'
 
         if os.path.isdir(path):
-            if os.path.isfile(os.path.join(path, '.git/index.lock')):
-                time.sleep(30)
-
-                return True
-            else:
-                return git.pull(path, revert = True)
+            return git.pull(path, revert = True)
         else:
             return git.clone(url, path, branch)
 
+    def url_devtools(self):
+        if __os__.osname() == 'linux':
+            return __os__.join(self.repos_devtools, 'U31R22_DEVTOOLS_LINUX')
+        elif __os__.osname() == 'solaris':
+            return __os__.join(self.repos_devtools, 'U31R22_DEVTOOLS_SOLARIS')
+        elif __os__.osname() == 'windows-x64':
+            return __os__.join(self.repos_devtools, 'U31R22_DEVTOOLS_WINDOWS-x64')
+        else:
+            return __os__.join(self.repos_devtools, 'U31R22_DEVTOOLS_WINDOWS')
+
     def expand_filename(self, version, name, destname, type, tmpdir, vars = None):
         dst = destname
 
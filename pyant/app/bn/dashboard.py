@@ -3,7 +3,7 @@ import os
 import os.path
 import re
 
-from pyant import command, git, maven
+from pyant import command, git, maven, pom
 from pyant.app import const, __dashboard__
 from pyant.builtin import __os__
 
@@ -72,6 +72,8 @@ class dashboard(__dashboard__):
         if module in ('interface',):
             return True
 
+        worktree = os.environ.get('DASHBOARD_WORKTREE')
+
         modules = []
 
         if module in ('ptn', 'ptn2'):
@@ -82,6 +84,8 @@ class dashboard(__dashboard__):
         for _module in modules:
             module_path = os.path.basename(self.repos[_module])
 
+            # the shared checkouts are reset and pulled under git.lock, the
+            # patchset itself goes to a worktree in worktree mode
             if os.path.isdir(module_path):
                 if not git.reset(module_path, branch):
                     return False
@@ -100,82 +104,103 @@ class dashboard(__dashboard__):
         module_path = os.path.basename(self.repos[module])
 
         if os.path.isdir(module_path):
-            try:
-                with __os__.chdir(module_path) as chdir:
-                    cmd = command.command()
+            if worktree:
+                with git.lock(module_path) as repo_lock:
+                    if not repo_lock.status:
+                        return False
 
-                    for line in cmd.command('git fetch %s +refs/changes/*:refs/changes/*' % repos):
-                        print(line)
+                    with __os__.chdir(module_path) as chdir:
+                        if not self.fetch_gerrit(repos, revision):
+                            return False
 
-                    if not cmd.result():
+                with git.worktree(module_path, revision) as tree:
+                    if not tree.status:
                         return False
 
-                    for line in cmd.command('git checkout -f %s' % revision):
-                        print(line)
+                    with __os__.chdir(tree.path) as chdir:
+                        status = self.__dashboard_gerrit__(revision, module, module_path)
+            else:
+                try:
+                    with __os__.chdir(module_path) as chdir:
+                        if not self.fetch_gerrit(repos, revision):
+                            return False
 
-                    if not cmd.result():
-                        return False
+                        cmd = command.command()
+
+                        for line in cmd.command('git checkout -f %s' % revision):
+                            print(line)
+
+                        pom.index.invalidate()
+
+                        if not cmd.result():
+                            return False
+
+                        status = self.__dashboard_gerrit__(revision, module, module_path)
+                finally:
+                    git.reset(module_path, branch)
+                    git.pull(module_path, revert = True)
 
-                    status = True
+        return status
+
+    # patchset revision of module checked out in the current directory
+    def __dashboard_gerrit__(self, revision, module, module_path):
+        status = True
 
-                    logs = git.log(None, '-1 --stat=256 %s' % revision, True)
+        logs = git.log(None, '-1 --stat=256 %s' % revision, True)
 
-                    if logs:
-                        paths = collections.OrderedDict()
-                        dbscript_paths = collections.OrderedDict()
+        if logs:
+            paths = collections.OrderedDict()
+            dbscript_paths = collections.OrderedDict()
 
-                        for log in logs:
-                            if log['changes']:
-                                for k, v in log['changes'].items():
-                                    if k in ('delete',):
-                                        continue
+            for log in logs:
+                if log['changes']:
+                    for k, v in log['changes'].items():
+                        if k in ('delete',):
+                            continue
 
-                                    for file in v:
-                                        if os.path.splitext(file)[-1] in ('.java', '.cpp', '.h', '.xml'):
-                                            path = self.pom_path(file)
+                        for file in v:
+                            if os.path.splitext(file)[-1] in ('.java', '.cpp', '.h', '.xml'):
+                                path = self.pom_path(file)
 
-                                            if path:
-                                                if os.path.splitext(file)[-1] in ('.xml',):
-                                                    if re.search(r'^code_c\/database\/.*\/xml\/.*\.xml$', file):
-                                                        if os.path.isfile('code_c/database/dbscript/pom.xml'):
-                                                            if os.path.isfile(os.path.join(os.path.dirname(file), '../pom.xml')):
-                                                                dbscript_paths['code_c/database/dbscript'] = []
-                                                else:
-                                                    if path not in paths:
-                                                        paths[path] = []
+                                if path:
+                                    if os.path.splitext(file)[-1] in ('.xml',):
+                                        if re.search(r'^code_c\/database\/.*\/xml\/.*\.xml$', file):
+                                            if os.path.isfile('code_c/database/dbscript/pom.xml'):
+                                                if os.path.isfile(os.path.join(os.path.dirname(file), '../pom.xml')):
+                                                    dbscript_paths['code_c/database/dbscript'] = []
+                                    else:
+                                        if path not in paths:
+                                            paths[path] = []
 
-                                                    paths[path].append(os.path.abspath(file))
+                                        paths[path].append(os.path.abspath(file))
 
-                        paths = self.expand_dashboard_gerrit(module_path, paths, dbscript_paths)
+            paths = self.expand_dashboard_gerrit(module_path, paths, dbscript_paths)
 
-                        for path in paths:
-                            if os.path.isdir(path):
-                                lang = None
+            for path in paths:
+                if os.path.isdir(path):
+                    lang = None
 
-                                if __os__.normpath(path).startswith('code_c/'):
-                                    lang = 'cpp'
+                    if __os__.normpath(path).startswith('code_c/'):
+                        lang = 'cpp'
 
-                                with __os__.chdir(path) as chdir:
-                                    if module in ('interface',):
-                                        mvn = maven.maven()
-                                        mvn.notification = '<%s_DASHBOARD_GERRIT_BUILD 通知> 编译失败, 请尽快处理' % self.name.upper()
+                    with __os__.chdir(path) as chdir:
+                        if module in ('interface',):
+                            mvn = maven.maven()
+                            mvn.notification = '<%s_DASHBOARD_GERRIT_BUILD 通知> 编译失败, 请尽快处理' % self.name.upper()
 
-                                        mvn.clean()
+                            mvn.clean()
 
-                                        cmdline = 'mvn install -fn -U'
+                            cmdline = 'mvn install -fn -U'
 
-                                        if not mvn.compile(cmdline, None, lang):
-                                            status = False
+                            if not mvn.compile(cmdline, None, lang):
+                                status = False
 
-                                            continue
-                                    else:
-                                        if not self.kw_check('.', lang, paths[path]):
-                                            status = False
+                                continue
+                        else:
+                            if not self.kw_check('.', lang, paths[path]):
+                                status = False
 
-                                            continue
-            finally:
-                git.reset(module_path, branch)
-                git.pull(module_path, revert = True)
+                                continue
 
         return status
 
@@ -187,6 +212,13 @@ class dashboard(__dashboard__):
     def environ(self, lang = None):
         return build.build().environ(lang)
 
+    def compile_upstream(self, lang = None):
+        bn_build = build.build()
+        bn_build.path = self.path
+
+        with __os__.chdir('..') as chdir:
+            return [os.path.abspath(x) for x in bn_build.compile_upstream(None, lang)]
+
     def expand_dashboard(self, path, file):
         file = __os__.normpath(file)
 
@@ -9,7 +9,7 @@ import zipfile
 
 from lxml import etree
 
-from pyant import git, maven
+from pyant import git, maven, pom
 from pyant.app import const, __patch__, __installation__
 from pyant.app.bn import build
 from pyant.builtin import __os__, __string__
@@ -52,11 +52,30 @@ class patch(__patch__):
 
         status = True
 
+        # partial clone and sparse checkout of the source and compile paths of
+        # the pending patch xml, build_source() widens the cone on demand
+        sparse = os.environ.get('PATCH_SPARSE')
+
         with __os__.chdir(self.path) as chdir:
+            if sparse:
+                sparse_files = self.sparse_files()
+
             os.makedirs('code', exist_ok = True)
 
             with __os__.chdir('code') as _chdir:
                 for module in self.modules:
+                    if sparse:
+                        if not os.path.isdir(module):
+                            if not git.clone(self.modules[module], module, branch, '--filter=blob:none --sparse'):
+                                status = False
+
+                                continue
+
+                        if not git.sparse_checkout(module, self.sparse_dirs(module, sparse_files.get(module, []))):
+                            status = False
+
+                            continue
+
                     if os.path.isdir(module):
                         if not git.pull(module, revert = True):
                             status = False
@@ -107,6 +126,10 @@ class patch(__patch__):
 
                 return False
 
+            if git.is_sparse(path):
+                if not git.sparse_checkout(path, self.sparse_dirs(path, info['source'] + list(info['compile'].keys())), True):
+                    return False
+
             if not git.pull(path, revert = True):
                 return False
 
@@ -137,6 +160,8 @@ class patch(__patch__):
                     else:
                         return False
 
+            pom.index.invalidate()
+
         return True
 
     def build_compile(self, info):
@@ -296,6 +321,66 @@ class patch(__patch__):
 
         return True
 
+    # module: source and compile paths of the pending patch xml
+    def sparse_files(self):
+        files = collections.OrderedDict()
+
+        for file in glob.iglob('xml/*.xml', recursive = True):
+            infoes = self.load_xml(file)
+
+            if not infoes:
+                continue
+
+            for info in infoes:
+                if info['name'] not in files:
+                    files[info['name']] = []
+
+                files[info['name']] += info['source'] + list(info['compile'].keys())
+
+        return files
+
+    # sparse checkout dirs of files, a file adds its directory. the type comes
+    # from the HEAD tree of the repository path (trees are always present in
+    # a blob filtered clone), paths not in HEAD are guessed by extension
+    def sparse_dirs(self, path, files):
+        dirs = []
+
+        reader = git.catfile.get(path)
+
+        # entry types come from the parent trees, a blob:none clone has every
+        # tree but looking up a blob itself fetches it
+        trees = {}
+
+        for file in files:
+            file = __os__.normpath(file).strip('/')
+
+            object = None
+
+            if reader:
+                dirname, name = os.path.split(file)
+
+                if dirname not in trees:
+                    entries = reader.tree('HEAD:%s' % dirname if dirname else 'HEAD')
+                    trees[dirname] = dict((x[-1], x[1]) for x in entries or ())
+
+                object = trees[dirname].get(name)
+
+            if object:
+                if object == 'tree':
+                    dir = file
+                else:
+                    dir = os.path.dirname(file)
+            else:
+                if os.path.splitext(file)[-1]:
+                    dir = os.path.dirname(file)
+                else:
+                    dir = file
+
+            if dir and dir not in dirs:
+                dirs.append(dir)
+
+        return dirs
+
     def expand_filename(self, file):
         pathname, extname = os.path.splitext(file)
 
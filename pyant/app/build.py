@@ -13,7 +13,7 @@ import zipfile
 
 from lxml import etree
 
-from pyant import check, command, git, maven, password, smtp
+from pyant import cache, check, command, git, maven, password, smtp
 from pyant.app import const
 from pyant.builtin import __os__, __string__
 
@@ -53,20 +53,49 @@ class build():
 
         path = os.path.join(self.path, dirname)
 
+        if not cmd:
+            cmd = 'mvn install -fn -U'
+
         if os.path.isdir(path):
+            # unchanged since the last successful build, the outputs are
+            # restored and only published again
+            build_cache = cache.cache.get(cmd, lang)
+            fingerprint = None
+
+            if build_cache:
+                upstream = [os.path.abspath(x) for x in self.compile_upstream(dirname, lang)]
+
             with __os__.chdir(path) as chdir:
                 mvn = maven.maven()
                 mvn.notification = '<%s_BUILD 通知> 编译失败, 请尽快处理' % self.name.upper()
 
+                if build_cache:
+                    fingerprint = build_cache.fingerprint('.', cmd, lang, upstream = upstream)
+
+                    if build_cache.restore(fingerprint, '.'):
+                        if cache.publish_cmdline(cmd):
+                            return mvn.compile(cache.publish_cmdline(cmd), None, lang, all)
+                        else:
+                            return True
+
                 if clean:
                     mvn.clean()
 
-                return mvn.compile(cmd, retry_cmd, lang, all)
+                status = mvn.compile(cmd, retry_cmd, lang, all)
+
+                if status and build_cache:
+                    build_cache.store(fingerprint, '.')
+
+                return status
         else:
             print('no such directory: %s' % os.path.normpath(path))
 
             return False
 
+    # repositories of the workspace the build of self.path is built against
+    def compile_upstream(self, dirname = None, lang = None):
+        return []
+
     def package(self, version, type = None):
         path = os.path.dirname(self.package_home(version, type))
 
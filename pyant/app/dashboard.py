@@ -5,7 +5,7 @@ import os.path
 
 from lxml import etree
 
-from pyant import check, command, git, maven, password, smtp
+from pyant import cache, check, command, git, maven, password, pom, smtp
 from pyant.app import const
 from pyant.builtin import __os__, __string__
 
@@ -50,6 +50,10 @@ class dashboard:
             return False
 
     def dashboard_gerrit(self, repos, revision, branch = None):
+        worktree = os.environ.get('DASHBOARD_WORKTREE')
+
+        # the shared checkout is reset and pulled under git.lock, the
+        # patchset itself goes to a worktree in worktree mode
         if os.path.isdir(self.path):
             if not git.reset(self.path, branch):
                 return False
@@ -60,97 +64,41 @@ class dashboard:
         status = True
 
         if os.path.isdir(self.path):
-            try:
-                with __os__.chdir(self.path) as chdir:
-                    cmd = command.command()
-
-                    for line in cmd.command('git fetch %s +refs/changes/*:refs/changes/*' % repos):
-                        print(line)
-
-                    if not cmd.result():
+            if worktree:
+                with git.lock(self.path) as repo_lock:
+                    if not repo_lock.status:
                         return False
 
-                    for line in cmd.command('git checkout -f %s' % revision):
-                        print(line)
+                    with __os__.chdir(self.path) as chdir:
+                        if not self.fetch_gerrit(repos, revision):
+                            return False
 
-                    if not cmd.result():
+                with git.worktree(self.path, revision) as tree:
+                    if not tree.status:
                         return False
 
-                    status = True
-
-                    logs = git.log(None, '-1 --stat=256 %s' % revision, True)
-
-                    if logs:
-                        paths = collections.OrderedDict()
-
-                        for log in logs:
-                            if log['changes']:
-                                for k, v in log['changes'].items():
-                                    if k in ('delete',):
-                                        continue
-
-                                    for file in v:
-                                        if os.path.splitext(file)[-1] in ('.java',):
-                                            path = self.pom_path(file)
-
-                                            if path:
-                                                if path not in paths:
-                                                    paths[path] = []
-
-                                                paths[path].append(os.path.abspath(file))
-
-                        for path in paths:
-                            if os.path.isdir(path):
-                                lang = None
-
-                                if __os__.normpath(path).startswith('code_c/'):
-                                    lang = 'cpp'
-
-                                with __os__.chdir(path) as chdir:
-                                    if path in ('code_c/build',):
-                                        mvn = maven.maven()
-
-                                        if not mvn.clean():
-                                            if os.environ.get('GERRIT_EMAIL'):
-                                                admin_addrs = None
+                    with __os__.chdir(tree.path) as chdir:
+                        status = self.__dashboard_gerrit__(revision)
+            else:
+                try:
+                    with __os__.chdir(self.path) as chdir:
+                        if not self.fetch_gerrit(repos, revision):
+                            return False
 
-                                                if os.environ.get('SENDMAIL.ADMIN'):
-                                                    admin_addrs = __string__.split(os.environ.get('SENDMAIL.ADMIN'))
+                        cmd = command.command()
 
-                                                line = ''
+                        for line in cmd.command('git checkout -f %s' % revision):
+                            print(line)
 
-                                                if os.environ.get('BUILD_URL'):
-                                                    console_url = __os__.join(os.environ['BUILD_URL'], 'console')
-                                                    line = '详细信息: <a href="%s">%s</a>' % (console_url, console_url)
+                        pom.index.invalidate()
 
-                                                smtp.sendmail(
-                                                    '<%s_DASHBOARD_GERRIT_BUILD 通知> 编译失败, 请尽快处理' % self.name.upper(),
-                                                    os.environ['GERRIT_EMAIL'], admin_addrs, line
-                                                )
+                        if not cmd.result():
+                            return False
 
-                                            return False
-                                        else:
-                                            return True
-
-                                    # mvn = maven.maven()
-                                    # mvn.notification = '<%s_DASHBOARD_GERRIT_BUILD 通知> 编译失败, 请尽快处理' % self.name.upper()
-                                    #
-                                    # mvn.clean()
-                                    #
-                                    # cmdline = 'mvn install -fn -U'
-                                    #
-                                    # if not mvn.compile(cmdline):
-                                    #     status = False
-                                    #
-                                    #     continue
-
-                                    if not self.kw_check('.', lang, paths[path]):
-                                        status = False
-
-                                        continue
-            finally:
-                git.reset(self.path, branch)
-                git.pull(self.path, revert = True)
+                        status = self.__dashboard_gerrit__(revision)
+                finally:
+                    git.reset(self.path, branch)
+                    git.pull(self.path, revert = True)
 
         return status
 
@@ -175,43 +123,45 @@ class dashboard:
             if os.path.isdir(os.path.join(path, '.git')):
                 with __os__.chdir(path) as chdir:
                     if path in rev.keys():
-                        arg = '--stat=256 %s..HEAD' % rev[path][:6]
+                        arg = '%s..HEAD' % rev[path][:6]
 
-                        logs = git.log(None, arg)
+                        revision = None
 
-                        if logs:
-                            authors = []
-                            tmp_paths = []
+                        authors = []
+                        tmp_paths = []
 
-                            for log in logs:
-                                if log['changes']:
-                                    if log['author'] not in authors:
-                                        authors.append(log['author'])
+                        for log in git.iterlog(None, arg):
+                            revision = log['revision']
 
-                                    for k, v in log['changes'].items():
-                                        for file in v:
-                                            if expand_dashboard:
-                                                filenames = expand_dashboard(path, file)
+                            if log['changes']:
+                                if log['author'] not in authors:
+                                    authors.append(log['author'])
 
-                                                if filenames:
-                                                    if isinstance(filenames, str):
-                                                        filenames = (filenames,)
-                                                else:
-                                                    filenames = ()
+                                for k, v in log['changes'].items():
+                                    for file in v:
+                                        if expand_dashboard:
+                                            filenames = expand_dashboard(path, file)
+
+                                            if filenames:
+                                                if isinstance(filenames, str):
+                                                    filenames = (filenames,)
                                             else:
-                                                filenames = (file,)
+                                                filenames = ()
+                                        else:
+                                            filenames = (file,)
 
-                                            for filename in filenames:
-                                                dir = self.pom_path(filename)
+                                        for filename in filenames:
+                                            dir = self.pom_path(filename)
 
-                                                if dir:
-                                                    if dir not in tmp_paths:
-                                                        tmp_paths.append(dir)
+                                            if dir:
+                                                if dir not in tmp_paths:
+                                                    tmp_paths.append(dir)
 
-                            if tmp_paths:
-                                changes[path] = (authors, tmp_paths)
+                        if tmp_paths:
+                            changes[path] = (authors, tmp_paths)
 
-                            changes_rev[path] = logs[-1]['revision']
+                        if revision:
+                            changes_rev[path] = revision
                         else:
                             changes_rev[path] = rev[path]
                     else:
@@ -237,6 +187,85 @@ class dashboard:
 
         return changes
 
+    # patchset revision checked out in the current directory
+    def __dashboard_gerrit__(self, revision):
+        status = True
+
+        logs = git.log(None, '-1 --stat=256 %s' % revision, True)
+
+        if logs:
+            paths = collections.OrderedDict()
+
+            for log in logs:
+                if log['changes']:
+                    for k, v in log['changes'].items():
+                        if k in ('delete',):
+                            continue
+
+                        for file in v:
+                            if os.path.splitext(file)[-1] in ('.java',):
+                                path = self.pom_path(file)
+
+                                if path:
+                                    if path not in paths:
+                                        paths[path] = []
+
+                                    paths[path].append(os.path.abspath(file))
+
+            for path in paths:
+                if os.path.isdir(path):
+                    lang = None
+
+                    if __os__.normpath(path).startswith('code_c/'):
+                        lang = 'cpp'
+
+                    with __os__.chdir(path) as chdir:
+                        if path in ('code_c/build',):
+                            mvn = maven.maven()
+
+                            # mvn clean fails on a broken pom.xml, which is
+                            # what the patchset is checked for
+                            if not mvn.clean_mvn():
+                                if os.environ.get('GERRIT_EMAIL'):
+                                    admin_addrs = None
+
+                                    if os.environ.get('SENDMAIL.ADMIN'):
+                                        admin_addrs = __string__.split(os.environ.get('SENDMAIL.ADMIN'))
+
+                                    line = ''
+
+                                    if os.environ.get('BUILD_URL'):
+                                        console_url = __os__.join(os.environ['BUILD_URL'], 'console')
+                                        line = '详细信息: <a href="%s">%s</a>' % (console_url, console_url)
+
+                                    smtp.sendmail(
+                                        '<%s_DASHBOARD_GERRIT_BUILD 通知> 编译失败, 请尽快处理' % self.name.upper(),
+                                        os.environ['GERRIT_EMAIL'], admin_addrs, line
+                                    )
+
+                                return False
+                            else:
+                                return True
+
+                        # mvn = maven.maven()
+                        # mvn.notification = '<%s_DASHBOARD_GERRIT_BUILD 通知> 编译失败, 请尽快处理' % self.name.upper()
+                        #
+                        # mvn.clean()
+                        #
+                        # cmdline = 'mvn install -fn -U'
+                        #
+                        # if not mvn.compile(cmdline):
+                        #     status = False
+                        #
+                        #     continue
+
+                        if not self.kw_check('.', lang, paths[path]):
+                            status = False
+
+                            continue
+
+        return status
+
     def __dashboard__(self, paths, ignores = None, all = False):
         filename = os.path.abspath(os.path.join('../errors', '%s.json' % os.path.basename(os.getcwd())))
 
@@ -262,20 +291,39 @@ class dashboard:
 
         for path in paths:
             if os.path.isdir(path):
+                if 'code_c/' in __os__.normpath(path):
+                    cmdline = 'mvn deploy -fn -U -Djobs=10'
+                    lang = 'cpp'
+                else:
+                    cmdline = 'mvn deploy -fn -U'
+                    lang = None
+
+                # unchanged since the last successful build, the outputs are
+                # restored and only deployed again
+                build_cache = cache.cache.get(cmdline, lang)
+                fingerprint = None
+
+                if build_cache:
+                    upstream = self.compile_upstream(lang)
+
                 with __os__.chdir(path) as chdir:
                     mvn = maven.maven()
                     mvn.notification = '<%s_DASHBOARD_BUILD 通知> 编译失败, 请尽快处理' % self.name.upper()
 
-                    mvn.clean()
+                    if build_cache:
+                        fingerprint = build_cache.fingerprint('.', cmdline, lang, upstream = upstream)
 
-                    if 'code_c/' in __os__.normpath(path):
-                        cmdline = 'mvn deploy -fn -U -Djobs=10'
-                        lang = 'cpp'
+                    if build_cache and build_cache.restore(fingerprint, '.'):
+                        status = mvn.compile(cache.publish_cmdline(cmdline), None, lang, all)
                     else:
-                        cmdline = 'mvn deploy -fn -U'
-                        lang = None
+                        mvn.clean()
+
+                        status = mvn.compile(cmdline, 'mvn deploy -fn -U', lang, all)
+
+                        if status and build_cache:
+                            build_cache.store(fingerprint, '.')
 
-                    if not mvn.compile(cmdline, 'mvn deploy -fn -U', lang, all):
+                    if not status:
                         if path not in errors:
                             errors.append(path)
 
@@ -350,6 +398,39 @@ class dashboard:
     def update(self, branch = None):
         return build.build().update(branch)
 
+    # absolute paths of the repositories the one of the working directory is
+    # built against
+    def compile_upstream(self, lang = None):
+        return []
+
+    # fetch only the change ref of the patchset (GERRIT_REFSPEC, or
+    # GERRIT_CHANGE_NUMBER and GERRIT_PATCHSET_NUMBER), all refs/changes of
+    # the project are fetched only if revision is still not available
+    def fetch_gerrit(self, repos, revision):
+        refspec = os.environ.get('GERRIT_REFSPEC')
+
+        if not refspec:
+            change = os.environ.get('GERRIT_CHANGE_NUMBER')
+            patchset = os.environ.get('GERRIT_PATCHSET_NUMBER')
+
+            if change and patchset:
+                refspec = 'refs/changes/%02d/%s/%s' % (int(change) % 100, change, patchset)
+
+        cmd = command.command()
+
+        if refspec:
+            for line in cmd.command('git fetch %s +%s:%s' % (repos, refspec, refspec)):
+                print(line)
+
+            if cmd.result():
+                if git.rev_parse('%s^{commit}' % revision):
+                    return True
+
+        for line in cmd.command('git fetch %s +refs/changes/*:refs/changes/*' % repos):
+            print(line)
+
+        return cmd.result()
+
     def kw_check(self, path = None, lang = None, filenames = None):
         if not path:
             path = '.'
@@ -479,15 +560,26 @@ class dashboard:
     def expand_dashboard(self, path, file):
         return file
 
+    # directory of the nearest pom.xml above path, from the pom index of the
+    # workspace
     def pom_path(self, path):
         if not path:
             return None
 
-        if os.path.isdir(path):
-            if os.path.isfile(os.path.join(path, 'pom.xml')):
-                return path
+        dirname = pom.index.get().pom_dir(path)
+
+        if not dirname:
+            return None
+
+        if os.path.isabs(path):
+            return dirname
+
+        dirname = os.path.relpath(dirname)
+
+        if dirname in ('.',) or dirname.startswith('..'):
+            return None
 
-        return self.pom_path(os.path.dirname(path))
+        return dirname
 
     def head(self, string):
         print()
@@ -10,7 +10,7 @@ import shutil
 import openpyxl
 from lxml import etree
 
-from pyant import command, daemon, password, smtp
+from pyant import daemon, password, scheduler, smtp
 from pyant.app import const
 from pyant.builtin import __os__, __string__
 
@@ -176,6 +176,8 @@ def auto():
     if auto_info:
         print('===== 启动补丁制作 =====')
 
+        sched = scheduler.scheduler(8, {'network': 4})
+
         for dir, name in auto_info:
             dir_paths = dir.split('/')
 
@@ -194,10 +196,9 @@ def auto():
                 jobname
             )
 
-            cmd = command.command()
+            sched.add(jobname, (cmdline, display_cmd), tags = 'network')
 
-            for line in cmd.command(cmdline, display_cmd = display_cmd):
-                print(line)
+        sched.puts_results(sched.run())
 
     return status
 
@@ -1,7 +1,7 @@
 import os
 import os.path
 
-from pyant import command, maven
+from pyant import command, git, maven
 from pyant.app import const, __build__
 from pyant.builtin import __os__
 
@@ -25,12 +25,7 @@ class build(__build__):
 
     def update(self, branch = None):
         if os.path.isdir(self.path):
-            if os.path.isfile(os.path.join(self.path, '.git/index.lock')):
-                time.sleep(30)
-
-                return True
-            else:
-                return git.pull(self.path, revert = True)
+            return git.pull(self.path, revert = True)
         else:
             return git.clone(self.repos, self.path, branch)
 
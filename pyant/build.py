@@ -21,9 +21,9 @@ Usage:
 
     command:
         update                      arg: module branch
-        updateall                   arg: branch
+        updateall                   arg: branch jobs
         compile_pom                 arg: cmd
-        compile                     arg: module cmd clean retry_cmd dirname lang
+        compile                     arg: module cmd clean retry_cmd dirname lang jobs
         package                     arg: branch type
         update_package              arg: branch type
         check                       arg:
@@ -102,10 +102,13 @@ def build(argv = None):
                 else:
                     return build.update(branch)
             elif command == 'updateall':
-                branch = arg[0]
+                branch, jobs, *_ = arg
+
+                if jobs:
+                    jobs = int(jobs)
 
                 if name in ('bn',):
-                    return build.update(None, branch)
+                    return build.update(None, branch, jobs)
                 else:
                     return build.update(branch)
             elif command == 'compile_pom':
@@ -113,17 +116,20 @@ def build(argv = None):
 
                 return build.compile_pom(cmd)
             elif command == 'compile':
-                module, cmd, clean, retry_cmd, dirname, lang, *_ = arg
+                module, cmd, clean, retry_cmd, dirname, lang, jobs, *_ = arg
 
                 if clean in (True, ):
                     clean = True
                 else:
                     clean = False
 
+                if jobs:
+                    jobs = int(jobs)
+
                 id = utils.metric_start(build.metric_id(module), module)
 
                 if name in ('bn',):
-                    status = build.compile(module, cmd, clean, retry_cmd, dirname, lang)
+                    status = build.compile(module, cmd, clean, retry_cmd, dirname, lang, jobs)
                 else:
                     status = build.compile(cmd, clean, retry_cmd, dirname)
 
@@ -0,0 +1,307 @@
+import hashlib
+import os
+import re
+import shutil
+import tarfile
+import tempfile
+
+from pyant import command, git, pom
+from pyant.builtin import __os__
+
+__all__ = ('cache', 'publish_cmdline')
+
+# PYANT_BUILD_CACHE      : directory of the build output cache, the cache is
+#                          disabled without it
+# PYANT_BUILD_CACHE_SIZE : max size of the cache in MB, the least recently
+#                          used outputs are removed first
+CACHE_HOME = os.environ.get('PYANT_BUILD_CACHE')
+CACHE_SIZE = int(os.environ.get('PYANT_BUILD_CACHE_SIZE') or 10240) * 1024 * 1024
+
+# outputs of the modules of a reactor, keyed by the fingerprint of their inputs
+#
+#   fingerprint: sources and pom.xml of the reactor modules, the fingerprints
+#                of the modules of the workspace they depend on, the HEAD and
+#                changed files of the upstream repositories, the versions and
+#                output homes of the environment, the osname and the cmdline
+#   outputs    : target and output directories of the reactor modules
+#
+# only the outputs come back. a cmdline publishing to the maven repositories
+# (install, deploy) runs again after a restore, with the compile and tests
+# skipped (publish_cmdline()). the cpp plugins have no such switch, their
+# publishing builds are not cached
+#
+#   build_cache = cache.cache.get(cmdline, lang)
+#
+#   if build_cache:
+#       fingerprint = build_cache.fingerprint('.', cmdline, lang, upstream = ['../platform'])
+#
+#       if build_cache.restore(fingerprint, '.'):
+#           if cache.publish_cmdline(cmdline):
+#               mvn.compile(cache.publish_cmdline(cmdline))
+#       elif mvn.compile(cmdline):
+#           build_cache.store(fingerprint, '.')
+class cache:
+    def __init__(self, home, size = None):
+        self.home = os.path.abspath(home)
+        self.size = size or CACHE_SIZE
+
+        # dirname -> fingerprint of the module
+        self.modules = {}
+
+        # (file, mtime, size) -> sha1 of the file
+        self.files = {}
+
+    # None if disabled or cmdline can not be cached (klocwork has to see the
+    # compile, cpp publishing builds)
+    @staticmethod
+    def get(cmdline, lang = None):
+        if not CACHE_HOME:
+            return None
+
+        if re.search(r'^(kwmaven|kwinject)\s+', cmdline):
+            return None
+
+        if lang in ('cpp', ) and RE_PUBLISH.search(cmdline):
+            return None
+
+        return cache(CACHE_HOME)
+
+    def fingerprint(self, path, *args, upstream = ()):
+        poms = pom.index.get(path)
+        modules = poms.reactor(path)
+
+        if not modules:
+            return None
+
+        artifactids = {}
+
+        for dirname, entry in poms.poms.items():
+            artifactids.setdefault(entry['artifactid'], []).append(dirname)
+
+        h = hashlib.sha1()
+
+        for arg in args:
+            h.update(str(arg).encode('utf8'))
+
+        for artifactid in sorted(modules):
+            h.update(artifactid.encode('utf8'))
+            h.update(self.fingerprint_module(poms, artifactids, modules[artifactid]['path'], []).encode('utf8'))
+
+        # the versions and output homes the pom.xml files read
+        for name in sorted(os.environ):
+            if RE_ENVIRON.search(name):
+                h.update(('%s=%s' % (name, os.environ[name])).encode('utf8'))
+
+        h.update(__os__.osname().encode('utf8'))
+
+        for dirname in upstream:
+            upstream_fingerprint = self.fingerprint_upstream(dirname)
+
+            if not upstream_fingerprint:
+                return None
+
+            h.update(upstream_fingerprint.encode('utf8'))
+
+        return h.hexdigest()
+
+    # True if the outputs of fingerprint are back in place
+    def restore(self, fingerprint, path):
+        if not fingerprint:
+            return False
+
+        file = os.path.join(self.home, '%s.tar.gz' % fingerprint)
+
+        if not os.path.isfile(file):
+            return False
+
+        poms = pom.index.get(path)
+
+        for dirname in self.outputs(poms, path):
+            shutil.rmtree(dirname, ignore_errors = True)
+
+        try:
+            with tarfile.open(file) as tar:
+                tar.extractall(poms.home)
+
+            os.utime(file)
+        except Exception as e:
+            print(e)
+
+            return False
+
+        print('restore outputs of %s from %s' % (os.path.normpath(path), file))
+
+        return True
+
+    def store(self, fingerprint, path):
+        if not fingerprint:
+            return False
+
+        file = os.path.join(self.home, '%s.tar.gz' % fingerprint)
+
+        poms = pom.index.get(path)
+        tmpfile = None
+
+        try:
+            os.makedirs(self.home, exist_ok = True)
+
+            # builds of the same fingerprint may store at the same time
+            fd, tmpfile = tempfile.mkstemp(suffix = '.tmp', dir = self.home)
+
+            with os.fdopen(fd, 'wb') as f:
+                with tarfile.open(fileobj = f, mode = 'w:gz', compresslevel = 1) as tar:
+                    for dirname in self.outputs(poms, path):
+                        if os.path.isdir(dirname):
+                            tar.add(dirname, os.path.relpath(dirname, poms.home))
+
+            os.chmod(tmpfile, 0o644)
+            os.replace(tmpfile, file)
+        except Exception as e:
+            print(e)
+
+            if tmpfile:
+                try:
+                    os.remove(tmpfile)
+                except OSError:
+                    pass
+
+            return False
+
+        self.evict()
+
+        return True
+
+    def evict(self):
+        files = []
+        total = 0
+
+        for name in os.listdir(self.home):
+            if name.endswith('.tar.gz'):
+                file = os.path.join(self.home, name)
+
+                try:
+                    st = os.stat(file)
+                except OSError:
+                    continue
+
+                files.append((st.st_mtime, st.st_size, file))
+                total += st.st_size
+
+        files.sort()
+
+        for mtime, size, file in files:
+            if total <= self.size:
+                break
+
+            try:
+                os.remove(file)
+
+                total -= size
+            except OSError:
+                pass
+
+    def outputs(self, poms, path):
+        dirnames = []
+
+        for info in poms.reactor(path).values():
+            for name in ('target', 'output'):
+                dirnames.append(os.path.join(info['path'], name))
+
+        return dirnames
+
+    # files of dirname (without the sub modules and outputs) and the modules
+    # of the workspace it depends on
+    def fingerprint_module(self, poms, artifactids, dirname, stack):
+        if dirname in self.modules:
+            return self.modules[dirname]
+
+        h = hashlib.sha1()
+
+        for dirpath, dirnames, filenames in os.walk(dirname):
+            dirnames[:] = sorted(x for x in dirnames
+                if not x.startswith('.') and x not in ('target', 'output') and os.path.join(dirpath, x) not in poms.poms)
+
+            for filename in sorted(filenames):
+                file = os.path.join(dirpath, filename)
+
+                h.update(__os__.normpath(os.path.relpath(file, dirname)).encode('utf8'))
+                h.update(self.fingerprint_file(file).encode('utf8'))
+
+        entry = poms.poms.get(dirname)
+
+        if entry:
+            stack = stack + [dirname]
+
+            for artifactid in sorted(entry['dependencies']):
+                for x in artifactids.get(artifactid, ()):
+                    if x not in stack:
+                        h.update(artifactid.encode('utf8'))
+                        h.update(self.fingerprint_module(poms, artifactids, x, stack).encode('utf8'))
+
+        self.modules[dirname] = h.hexdigest()
+
+        return self.modules[dirname]
+
+    # HEAD and the changed (staged, unstaged and untracked) files of the
+    # repository in dirname, its artifacts come from the maven repository.
+    # None outside git
+    def fingerprint_upstream(self, dirname):
+        h = hashlib.sha1()
+
+        h.update((git.rev_parse('HEAD', dirname) or '').encode('utf8'))
+
+        files = []
+
+        cmd = command.command()
+
+        for index, line in enumerate(cmd.command('git -c core.quotepath=off status --porcelain --untracked-files=all', cwd = dirname)):
+            if index < 2:
+                continue
+
+            line = line.rstrip()
+
+            if len(line) > 3:
+                files.append(line[3:].split(' -> ')[-1])
+
+        if not cmd.result():
+            return None
+
+        for file in sorted(files):
+            h.update(file.encode('utf8'))
+            h.update(self.fingerprint_file(os.path.join(dirname, file)).encode('utf8'))
+
+        return h.hexdigest()
+
+    def fingerprint_file(self, file):
+        try:
+            st = os.stat(file)
+        except OSError:
+            return ''
+
+        key = (file, st.st_mtime_ns, st.st_size)
+
+        if key not in self.files:
+            h = hashlib.sha1()
+
+            try:
+                with open(file, 'rb') as f:
+                    for data in iter(lambda: f.read(1024 * 1024), b''):
+                        h.update(data)
+            except OSError:
+                pass
+
+            self.files[key] = h.hexdigest()
+
+        return self.files[key]
+
+# ----------------------------------------------------------
+
+# cmdline publishing the restored outputs, None if cmdline does not publish
+def publish_cmdline(cmdline):
+    if RE_PUBLISH.search(cmdline):
+        return '%s -Dmaven.main.skip=true -Dmaven.test.skip=true' % cmdline
+    else:
+        return None
+
+RE_PUBLISH = re.compile(r'(^|\s)(install|deploy)(\s|$)')
+RE_ENVIRON = re.compile(r'(^|_)(VERSION|OUTPUT_HOME)$')
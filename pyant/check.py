@@ -28,9 +28,16 @@ class check:
         self.xml(ignores)
 
         if self.errors:
+            files = []
+
+            for type, file_info in self.errors.items():
+                files += list(file_info.keys())
+
+            infos = git.infos(files)
+
             for type, file_info in self.errors.items():
                 for file in file_info:
-                    info = git.info(file)
+                    info = infos.get(file)
 
                     if info:
                         file_info[file] = (
@@ -1,22 +1,57 @@
+import array
+import asyncio
+import bisect
+import codecs
+import collections
+import datetime
+import gzip
+import itertools
+import json
 import locale
+import lzma
 import os
-import time
+import re
+import signal
 import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+__all__ = ('command', 'asyncio_command', 'asyncio_run', 'decoder', 'capture', 'teefile')
+
+BLOCK_SIZE = 64 * 1024
+NON_ASCII = re.compile(rb'[\x80-\xff]')
 
-__all__ = ('command',)
+# resource usage of every command is appended to this jsonl file when set
+USAGE_FILE = os.environ.get('PYANT_COMMAND_USAGE')
 
 class command:
     def __init__(self):
         self.pipe = None
         self.async = False
 
-    def command(self, args, timeout = None, cwd = None, async = False, display_cmd = None):
+        self.killed = None
+        self.lock = threading.Lock()
+
+        self.usage = None
+
+    # timeout      : total wall-clock seconds
+    # idle_timeout : seconds without any output
+    #
+    # on expiry the whole process group (including grandchildren) is killed
+    # encoding     : output encoding, detected once per stream when None
+    # tee          : teefile or file name (.gz, .xz), output lines are also written to it
+    def command(self, args, timeout = None, cwd = None, async = False, display_cmd = None, idle_timeout = None, encoding = None, tee = None):
         self.pipe = None
         self.async = async
 
+        self.killed = None
+        self.usage = None
+
         self.pipe = subprocess.Popen(args, stdout = subprocess.PIPE,
             stderr = subprocess.STDOUT, stdin = subprocess.PIPE, cwd = cwd,
-            shell = True
+            shell = True, start_new_session = (os.name == 'posix')
         )
 
         if isinstance(args, str):
@@ -27,38 +62,149 @@ class command:
         if not display_cmd:
             display_cmd = cmd
 
-        for line in ('$ ' + display_cmd, '  in (' + os.getcwd() + ')'):
+        if cwd:
+            path = os.path.abspath(cwd)
+        else:
+            path = os.getcwd()
+
+        if isinstance(tee, str):
+            tee = teefile(tee)
+            tee_close = True
+        else:
+            tee_close = False
+
+        for line in ('$ ' + display_cmd, '  in (' + path + ')'):
+            if tee:
+                tee.write(line)
+
             yield line
 
-        t = time.time()
+        self.start = time.time()
+        self.last = self.start
 
-        while True:
-            if self.async:
-                break
+        finished = threading.Event()
 
-            if timeout:
-                if (time.time() - t) > timeout:
-                    self.pipe.kill()
+        if timeout or idle_timeout:
+            watchdog = threading.Thread(target = self.watchdog, args = (finished, timeout, idle_timeout))
+            watchdog.daemon = True
+            watchdog.start()
+
+        stream = decoder(encoding)
 
-                    timeout = None
+        try:
+            while True:
+                if self.async:
+                    break
 
-            line = self.pipe.stdout.readline()
+                data = self.pipe.stdout.read1(BLOCK_SIZE)
+
+                if data:
+                    self.last = time.time()
 
-            if line:
-                for encoding in (locale.getpreferredencoding(False), 'cp936', 'utf8'):
-                    try:
-                        string = line.decode(encoding).rstrip()
+                    for string in stream.decode(data):
+                        if tee:
+                            tee.write(string)
 
                         yield string
+                else:
+                    for string in stream.decode(b'', True):
+                        if tee:
+                            tee.write(string)
+
+                        yield string
+
+                    break
 
-                        break
-                    except:
-                        pass
+            self.wait(display_cmd, path)
+        except KeyboardInterrupt:
+            self.kill('interrupt')
+
+            raise
+        finally:
+            finished.set()
+
+        if self.killed:
+            line = '*** %s after %d seconds, process group killed ***' % (self.killed, time.time() - self.start)
+
+            if tee:
+                tee.write(line)
+
+            yield line
+
+        if tee:
+            if tee_close:
+                tee.close()
             else:
-                break
+                tee.flush()
+
+    # thread safe, may be called from any thread while command() is running
+    def cancel(self):
+        return self.kill('cancel')
+
+    # usage:
+    #   cmdline, cwd, start, returncode, killed
+    #   wall, utime, stime     : seconds
+    #   maxrss                 : KB, the largest process of the command
+    #   rchar, wchar           : bytes read/written
+    #   read_bytes, write_bytes: bytes read/written from/to storage
+    def wait(self, cmdline = None, cwd = None):
+        rusage = None
+        io = None
+
+        if hasattr(os, 'wait4'):
+            try:
+                # wait without reaping, /proc/<pid>/io of the zombie holds the
+                # totals of the command and its waited children
+                os.waitid(os.P_PID, self.pipe.pid, os.WEXITED | os.WNOWAIT)
+
+                io = proc_io(self.pipe.pid)
+
+                with self.lock:
+                    if self.pipe.returncode is None:
+                        pid, status, rusage = os.wait4(self.pipe.pid, 0)
+
+                        if os.WIFSIGNALED(status):
+                            self.pipe.returncode = -os.WTERMSIG(status)
+                        else:
+                            self.pipe.returncode = os.WEXITSTATUS(status)
+            except:
+                pass
 
         self.pipe.wait()
 
+        self.usage = usage(cmdline, cwd, self.start, self.pipe.returncode, self.killed, rusage, io)
+
+        return self.pipe.returncode
+
+    # the process group outlives the shell (grandchildren holding stdout), so
+    # it is killed until wait() has reaped the shell. no poll() here, it
+    # would reap the shell before wait() collects its resource usage
+    def kill(self, reason = None):
+        with self.lock:
+            if self.pipe and self.pipe.returncode is None:
+                if not self.killed:
+                    self.killed = reason or 'kill'
+
+                killpg(self.pipe.pid)
+
+                return True
+            else:
+                return False
+
+    def watchdog(self, finished, timeout, idle_timeout):
+        while not finished.wait(0.5):
+            if timeout:
+                if (time.time() - self.start) > timeout:
+                    self.kill('timeout')
+
+                    break
+
+            if idle_timeout:
+                if (time.time() - self.last) > idle_timeout:
+                    self.kill('idle timeout')
+
+                    break
+
     def peek_line(self, size = 200):
         line = ''
 
@@ -88,3 +234,545 @@ class command:
                 return False
         else:
             return None
+
+class asyncio_command:
+    def __init__(self):
+        self.proc = None
+
+        self.killed = None
+        self.usage = None
+
+    async def command(self, args, timeout = None, cwd = None, display_cmd = None, idle_timeout = None, encoding = None, tee = None):
+        self.proc = None
+
+        self.killed = None
+        self.usage = None
+
+        if isinstance(args, str):
+            cmd = args.strip()
+        else:
+            cmd = subprocess.list2cmdline([arg.strip() for arg in args])
+
+        if not display_cmd:
+            display_cmd = cmd
+
+        if cwd:
+            path = os.path.abspath(cwd)
+        else:
+            path = os.getcwd()
+
+        if isinstance(tee, str):
+            tee = teefile(tee)
+            tee_close = True
+        else:
+            tee_close = False
+
+        for line in ('$ ' + display_cmd, '  in (' + path + ')'):
+            if tee:
+                tee.write(line)
+
+            yield line
+
+        self.proc = await asyncio.create_subprocess_shell(cmd, stdout = subprocess.PIPE,
+            stderr = subprocess.STDOUT, stdin = subprocess.PIPE, cwd = cwd,
+            start_new_session = (os.name == 'posix')
+        )
+
+        t = time.time()
+
+        stream = decoder(encoding)
+
+        while True:
+            wait = None
+
+            if timeout:
+                wait = timeout - (time.time() - t)
+
+            if idle_timeout:
+                if wait is None or idle_timeout < wait:
+                    wait = idle_timeout
+
+            if wait is not None and wait <= 0:
+                self.kill('timeout')
+
+                break
+
+            try:
+                data = await asyncio.wait_for(self.proc.stdout.read(BLOCK_SIZE), wait)
+            except asyncio.TimeoutError:
+                if timeout and (time.time() - t) >= timeout:
+                    self.kill('timeout')
+                else:
+                    self.kill('idle timeout')
+
+                break
+
+            if data:
+                for string in stream.decode(data):
+                    if tee:
+                        tee.write(string)
+
+                    yield string
+            else:
+                break
+
+        for string in stream.decode(b'', True):
+            if tee:
+                tee.write(string)
+
+            yield string
+
+        await self.proc.wait()
+
+        # the event loop reaps the child, only wall time is available
+        self.usage = usage(display_cmd, path, t, self.proc.returncode, self.killed)
+
+        if self.killed:
+            line = '*** %s after %d seconds, process group killed ***' % (self.killed, time.time() - t)
+
+            if tee:
+                tee.write(line)
+
+            yield line
+
+        if tee:
+            if tee_close:
+                tee.close()
+            else:
+                tee.flush()
+
+    # thread safe, may be called from any thread while command() is running
+    def cancel(self):
+        return self.kill('cancel')
+
+    # the process group outlives the shell, asyncio sets returncode as soon
+    # as the shell exits
+    def kill(self, reason = None):
+        if self.proc:
+            if not self.killed:
+                self.killed = reason or 'kill'
+
+            killpg(self.proc.pid)
+
+            return True
+        else:
+            return False
+
+    async def wait(self):
+        if self.proc:
+            return await self.proc.wait()
+        else:
+            return None
+
+    def input(self, string):
+        if self.proc:
+            if not self.proc.stdin.is_closing():
+                self.proc.stdin.write(string.encode(locale.getpreferredencoding(False)))
+
+    def result(self, returncode = 0):
+        if isinstance(returncode, int):
+            returncode = (returncode,)
+
+        if self.proc:
+            if self.proc.returncode in returncode:
+                return True
+            else:
+                return False
+        else:
+            return None
+
+# coroutines:
+#   asyncio_command based coroutines, all of them run concurrently in one event loop
+#
+#   async def update(path):
+#       cmd = command.asyncio_command()
+#
+#       async for line in cmd.command('git pull', cwd = path):
+#           print(line)
+#
+#       return cmd.result()
+#
+#   command.asyncio_run(*[update(path) for path in paths])
+def asyncio_run(*coroutines):
+    if sys.platform == 'win32':
+        loop = asyncio.ProactorEventLoop()
+    else:
+        loop = asyncio.new_event_loop()
+
+    asyncio.set_event_loop(loop)
+
+    try:
+        return loop.run_until_complete(asyncio.gather(*coroutines))
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+class decoder:
+    def __init__(self, encoding = None):
+        self.encoding = encoding
+        self.decoder = None
+        self.pending = b''
+        self.tail = ''
+
+    # bytes block -> complete lines, the trailing partial line is kept until
+    # the next block (or final)
+    def decode(self, data, final = False):
+        if self.decoder is None:
+            if not self.encoding:
+                if not self.pending and not final and not NON_ASCII.search(data):
+                    return self.split(data.decode('ascii'), final)
+
+                # detect on complete lines only, a block may end inside a character
+                self.pending += data
+
+                index = self.pending.rfind(b'\n')
+
+                if index < 0 and not final:
+                    return []
+
+                self.encoding = self.detect(self.pending[:index + 1] or self.pending)
+
+                data = self.pending
+                self.pending = b''
+
+            self.decoder = codecs.getincrementaldecoder(self.encoding)(errors = 'replace')
+
+        return self.split(self.decoder.decode(data, final), final)
+
+    def split(self, string, final = False):
+        lines = (self.tail + string).split('\n')
+
+        if final:
+            self.tail = ''
+
+            if not lines[-1]:
+                lines.pop()
+        else:
+            self.tail = lines.pop()
+
+        return [line.rstrip() for line in lines]
+
+    # the first block holding non-ascii bytes decides the encoding of the stream
+    def detect(self, data):
+        encodings = (locale.getpreferredencoding(False), 'cp936', 'utf8')
+
+        for encoding in encodings:
+            try:
+                data.decode(encoding)
+
+                return encoding
+            except:
+                pass
+
+        return encodings[-1]
+
+# list like store of command output lines
+#
+#   the last `size` lines are kept in memory, older lines are spilled to a
+#   temporary file and indexed by line offset, so that slices (module logs)
+#   only read back the lines needed
+class capture:
+    def __init__(self, size = 10000, dirname = None):
+        self.size = size
+        self.dirname = dirname
+
+        self.lines = collections.deque()
+        self.offsets = array.array('q')
+        self.position = 0
+        self.file = None
+
+        self.block = (None, None)
+
+    def append(self, line):
+        self.lines.append(line)
+
+        if len(self.lines) > self.size:
+            self.spill(self.lines.popleft())
+
+    def extend(self, lines):
+        for line in lines:
+            self.append(line)
+
+    def clear(self):
+        self.close()
+
+        self.lines.clear()
+        self.offsets = array.array('q')
+        self.position = 0
+
+    def close(self):
+        if self.file:
+            try:
+                self.file.close()
+            except:
+                pass
+
+            self.file = None
+
+        self.block = (None, None)
+
+    def __len__(self):
+        return len(self.offsets) + len(self.lines)
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __iter__(self):
+        if self.offsets:
+            self.file.flush()
+            self.file.seek(0)
+
+            tail = b''
+
+            while True:
+                data = self.file.read(BLOCK_SIZE)
+
+                if not data:
+                    break
+
+                lines = (tail + data).split(b'\n')
+                tail = lines.pop()
+
+                for line in lines:
+                    yield line.decode('utf8')
+
+            self.file.seek(0, os.SEEK_END)
+
+        for line in list(self.lines):
+            yield line
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+
+            lines = []
+
+            if start < len(self.offsets):
+                lines += self.read(start, min(stop, len(self.offsets)))
+
+            start = max(start - len(self.offsets), 0)
+            stop = stop - len(self.offsets)
+
+            if start < stop:
+                lines += list(itertools.islice(self.lines, start, stop))
+
+            return lines
+        else:
+            if index < 0:
+                index += len(self)
+
+            if index < 0 or index >= len(self):
+                raise IndexError('capture index out of range')
+
+            if index < len(self.offsets):
+                block = index // 256
+
+                # the last block is read while it is still filling, spilled
+                # lines never change, read it again once index is past it
+                if self.block[0] != block or index - block * 256 >= len(self.block[-1]):
+                    self.block = (block, self.read(block * 256, min((block + 1) * 256, len(self.offsets))))
+
+                return self.block[-1][index - block * 256]
+            else:
+                return self.lines[index - len(self.offsets)]
+
+    def spill(self, line):
+        if self.file is None:
+            self.file = tempfile.TemporaryFile(dir = self.dirname)
+
+        data = (line + '\n').encode('utf8')
+
+        self.offsets.append(self.position)
+        self.file.write(data)
+        self.position += len(data)
+
+    def read(self, start, stop):
+        if start >= stop:
+            return []
+
+        if stop < len(self.offsets):
+            end = self.offsets[stop]
+        else:
+            end = self.position
+
+        self.file.flush()
+        self.file.seek(self.offsets[start])
+
+        data = self.file.read(end - self.offsets[start])
+
+        self.file.seek(0, os.SEEK_END)
+
+        return data.decode('utf8').split('\n')[:stop - start]
+
+# compressed log file written in independently compressed blocks (gzip
+# members or xz streams, both readable by zcat/xzcat), with a side index
+# file.idx of "first line number, compressed offset" per block, so that a
+# window of lines can be read back without decompressing the whole file
+class teefile:
+    def __init__(self, file, block_size = 1024 * 1024):
+        self.file = file
+        self.block_size = block_size
+
+        if file.endswith('.xz'):
+            self.compress = lzma.compress
+            self.decompress = lzma.decompress
+        else:
+            self.compress = gzip.compress
+            self.decompress = gzip.decompress
+
+        self.f = None
+        self.index = None
+
+        self.buffer = []
+        self.size = 0
+        self.lineno = 0
+        self.first = 0
+        self.offset = 0
+
+    def write(self, line):
+        if self.f is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.file)), exist_ok = True)
+
+            self.f = open(self.file, 'wb')
+            self.index = open(self.file + '.idx', 'w')
+
+        self.buffer.append(line)
+        self.size += len(line) + 1
+        self.lineno += 1
+
+        if self.size >= self.block_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            data = self.compress(('\n'.join(self.buffer) + '\n').encode('utf8'))
+
+            self.f.write(data)
+            self.index.write('%s %s\n' % (self.first, self.offset))
+
+            self.offset += len(data)
+            self.first = self.lineno
+
+            self.buffer = []
+            self.size = 0
+
+        if self.f:
+            self.f.flush()
+            self.index.flush()
+
+    def close(self):
+        self.flush()
+
+        if self.f:
+            self.f.close()
+            self.index.close()
+
+            self.f = None
+            self.index = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    # lines[start:stop] of a finished file
+    def read(self, start = 0, stop = None):
+        blocks = []
+
+        with open(self.file + '.idx') as f:
+            for line in f:
+                if line.strip():
+                    blocks.append(tuple(int(x) for x in line.split()))
+
+        if not blocks:
+            return []
+
+        firsts = [first for first, offset in blocks]
+
+        lines = []
+
+        with open(self.file, 'rb') as f:
+            for i in range(max(bisect.bisect_right(firsts, start) - 1, 0), len(blocks)):
+                first, offset = blocks[i]
+
+                if stop is not None and first >= stop:
+                    break
+
+                f.seek(offset)
+
+                if i + 1 < len(blocks):
+                    data = f.read(blocks[i + 1][-1] - offset)
+                else:
+                    data = f.read()
+
+                block = self.decompress(data).decode('utf8').split('\n')[:-1]
+
+                for lineno, line in enumerate(block, first):
+                    if lineno >= start and (stop is None or lineno < stop):
+                        lines.append(line)
+
+        return lines
+
+# ----------------------------------------------------------
+
+def killpg(pid):
+    try:
+        if os.name == 'posix':
+            os.killpg(pid, signal.SIGKILL)
+        else:
+            subprocess.call('taskkill /F /T /PID %s' % pid, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+    except:
+        pass
+
+def proc_io(pid):
+    io = {}
+
+    try:
+        with open('/proc/%s/io' % pid) as f:
+            for line in f:
+                name, value = line.split(':', 1)
+
+                if name in ('rchar', 'wchar', 'read_bytes', 'write_bytes'):
+                    io[name] = int(value)
+    except:
+        pass
+
+    return io
+
+def usage(cmdline, cwd, start, returncode, killed, rusage = None, io = None):
+    info = collections.OrderedDict([
+        ('cmdline'      , cmdline),
+        ('cwd'          , cwd),
+        ('start'        , datetime.datetime.fromtimestamp(start).strftime('%Y-%m-%d %H:%M:%S')),
+        ('wall'         , round(time.time() - start, 3)),
+        ('utime'        , None),
+        ('stime'        , None),
+        ('maxrss'       , None),
+        ('rchar'        , None),
+        ('wchar'        , None),
+        ('read_bytes'   , None),
+        ('write_bytes'  , None),
+        ('returncode'   , returncode),
+        ('killed'       , killed)
+    ])
+
+    if rusage:
+        info['utime'] = round(rusage.ru_utime, 3)
+        info['stime'] = round(rusage.ru_stime, 3)
+        info['maxrss'] = rusage.ru_maxrss
+
+    if io:
+        info.update(io)
+
+    if USAGE_FILE:
+        try:
+            with open(USAGE_FILE, 'a', encoding = 'utf8') as f:
+                f.write(json.dumps(info, ensure_ascii = False) + '\n')
+        except Exception as e:
+            print(e)
+
+    return info
@@ -15,12 +15,18 @@ class PyroCommand():
     def __init__(self):
         self.cmd = None
 
-    def command(self, cmdline, timeout = None, cwd = None, async = False, display_cmd = None):
+    def command(self, cmdline, timeout = None, cwd = None, async = False, display_cmd = None, idle_timeout = None):
         self.cmd = command.command()
 
-        for line in self.cmd.command(cmdline, timeout, cwd, async, display_cmd):
+        for line in self.cmd.command(cmdline, timeout, cwd, async, display_cmd, idle_timeout):
             yield line
 
+    def cancel(self):
+        if self.cmd:
+            return self.cmd.cancel()
+        else:
+            return False
+
     def result(self, returncode = 0):
         if self.cmd:
             return self.cmd.result(returncode)
@@ -31,9 +37,9 @@ class PyroCommandProxy():
     def __init__(self, ip):
         self.proxy = Pyro4.Proxy('PYRO:daemon.command@%s:9000' % ip)
 
-    def command(self, cmdline, timeout = None, cwd = None, async = False, display_cmd = None):
+    def command(self, cmdline, timeout = None, cwd = None, async = False, display_cmd = None, idle_timeout = None):
         try:
-            for line in self.proxy.command(cmdline, timeout, cwd, async, display_cmd):
+            for line in self.proxy.command(cmdline, timeout, cwd, async, display_cmd, idle_timeout):
                 print(line)
 
             if self.proxy.result():
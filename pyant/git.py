@@ -1,100 +1,82 @@
+import bisect
+import codecs
 import collections
 import datetime
-import glob
+import hashlib
+import json
 import os
 import re
+import shutil
 import subprocess
+import tempfile
+import threading
+import time
 
-from pyant import command
-from pyant.builtin import __os__
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
 
-__all__ = ('clone', 'pull', 'log', 'info', 'config', 'home')
+from pyant import command, scheduler
+from pyant.builtin import __os__
 
-def clone(url, path = None, branch = None, arg = None):
-    cmdline = 'git clone'
+__all__ = ('clone', 'mirror', 'pull', 'sync', 'sparse_checkout', 'log', 'iterlog', 'info', 'infos', 'blames', 'config', 'home', 'lock', 'worktree', 'catfile')
 
-    if branch:
-        cmdline += ' -b %s' % branch
+# node local bare mirrors of the cloned repositories, clone() borrows the
+# objects of the mirror and only fetches the delta from the remote
+MIRROR_HOME = os.environ.get('PYANT_GIT_MIRROR')
 
-    if arg:
-        cmdline += ' %s -- %s' % (arg, url)
-    else:
-        cmdline += ' %s' % url
+# seconds to wait for the repository lock of another job
+LOCK_TIMEOUT = int(os.environ.get('PYANT_GIT_LOCK_TIMEOUT') or 3600)
 
-    if path:
-        cmdline += ' %s' % os.path.normpath(path)
+# index.lock older than this (seconds) is left over by a killed git
+INDEX_LOCK_STALE = 600
 
-    cmd = command.command()
+# max size of the blame cache in MB, the least recently used files are
+# removed first
+BLAME_CACHE_SIZE = int(os.environ.get('PYANT_GIT_BLAME_CACHE_SIZE') or 256) * 1024 * 1024
 
-    for line in cmd.command(cmdline):
-        print(line)
+def clone(url, path = None, branch = None, arg = None, mirror_home = None):
+    changed()
 
-    if cmd.result():
-        if not path:
-            path = os.path.basename(url)
+    with lock(path or os.path.basename(url)) as repo_lock:
+        if not repo_lock.status:
+            return False
 
-        if is_submodule(path):
-            if not branch:
-                branch = 'master'
+        cmdline = 'git clone'
 
-            with __os__.chdir(path) as chdir:
-                cmds = (
-                    'git submodule init',
-                    'git submodule update',
-                    'git submodule foreach git checkout %s' % branch,
-                    'git submodule foreach git pull'
-                )
+        if branch:
+            cmdline += ' -b %s' % branch
 
-                for cmdline in cmds:
-                    for line in cmd.command(cmdline):
-                        print(line)
-
-                    if not cmd.result():
-                        return False
-
-        return True
-    else:
-        return False
-
-def pull(path = None, arg = None, revert = False):
-    if not path:
-        path = '.'
+        reference = mirror(url, mirror_home)
 
-    if os.path.isdir(path):
-        cmdline = 'git pull'
+        if reference:
+            cmdline += ' --reference "%s" --dissociate' % reference
 
         if arg:
-            cmdline += ' %s' % arg
+            cmdline += ' %s -- %s' % (arg, url)
+        else:
+            cmdline += ' %s' % url
 
-        with __os__.chdir(path) as chdir:
-            if revert:
-                cmd = command.command()
+        if path:
+            cmdline += ' %s' % os.path.normpath(path)
 
-                for line in cmd.command('git checkout -- .'):
-                    print(line)
+        cmd = command.command()
 
-            cmd = command.command()
+        for line in cmd.command(cmdline):
+            print(line)
 
-            for line in cmd.command(cmdline):
-                print(line)
+        if cmd.result():
+            if not path:
+                path = os.path.basename(url)
 
-            if cmd.result():
-                if is_submodule():
+            if is_submodule(path):
+                if not branch:
                     branch = 'master'
 
-                    for key in config().keys():
-                        m = re.search(r'^branch\.(.*)\.remote$', key)
-
-                        if m:
-                            branch = m.group(1)
-
-                            break
-
-                    if revert:
-                        for line in cmd.command('git submodule foreach git checkout -- .'):
-                            print(line)
-
+                with __os__.chdir(path) as chdir:
                     cmds = (
+                        'git submodule init',
                         'git submodule update',
                         'git submodule foreach git checkout %s' % branch,
                         'git submodule foreach git pull'
@@ -107,195 +89,429 @@ def pull(path = None, arg = None, revert = False):
                         if not cmd.result():
                             return False
 
-                return True
-            else:
-                return False
-    else:
-        print('no such directory: %s' % os.path.normpath(path))
+            return True
+        else:
+            return False
 
-        return False
+# create or refresh the bare mirror of url under mirror_home (default
+# MIRROR_HOME), return the mirror path or None
+def mirror(url, mirror_home = None):
+    path = mirror_path(url, mirror_home)
+
+    if not path:
+        return None
+
+    # one clone or fetch at a time per mirror, across processes
+    with lock(path) as mirror_lock:
+        if not mirror_lock.status:
+            return None
+
+        cmd = command.command()
+
+        for cmdline in mirror_cmdlines(path, url):
+            for line in cmd.command(cmdline):
+                print(line)
+
+            if not cmd.result():
+                return None
+
+    return path
+
+def pull(path = None, arg = None, revert = False):
+    changed()
 
-def log(path = None, arg = None, display = False):
     if not path:
         path = '.'
 
-    if os.path.exists(path):
+    with lock(path) as repo_lock:
+        if not repo_lock.status:
+            return False
+
         if os.path.isdir(path):
-            name = '.'
-        else:
-            name = os.path.basename(path)
-            path = os.path.dirname(path)
+            cmdline = 'git pull'
 
-        cmdline = 'git log'
+            if arg:
+                cmdline += ' %s' % arg
 
-        if arg:
-            cmdline += ' %s' % arg
+            with __os__.chdir(path) as chdir:
+                if revert:
+                    cmd = command.command()
+
+                    for line in cmd.command('git checkout -- .'):
+                        print(line)
+
+                cmd = command.command()
+
+                for line in cmd.command(cmdline):
+                    print(line)
+
+                if cmd.result():
+                    if is_submodule():
+                        branch = 'master'
+
+                        for key in config().keys():
+                            m = re.search(r'^branch\.(.*)\.remote$', key)
+
+                            if m:
+                                branch = m.group(1)
+
+                                break
+
+                        if revert:
+                            for line in cmd.command('git submodule foreach git checkout -- .'):
+                                print(line)
+
+                        cmds = (
+                            'git submodule update',
+                            'git submodule foreach git checkout %s' % branch,
+                            'git submodule foreach git pull'
+                        )
+
+                        for cmdline in cmds:
+                            for line in cmd.command(cmdline):
+                                print(line)
+
+                            if not cmd.result():
+                                return False
+
+                    return True
+                else:
+                    return False
         else:
-            cmdline += ' -1 --stat=256'
+            print('no such directory: %s' % os.path.normpath(path))
 
-        cmdline += ' -- %s' % subprocess.list2cmdline([name]).strip()
+            return False
 
-        with __os__.chdir(path) as chdir:
-            lines = []
+# clone() or pull() of many repositories in parallel
+#
+#   repos : name -> (url, path)
+#
+# phase 1 clones (through the mirror of mirror_home) or pulls every
+# repository, phase 2 updates the submodules of every repository, phase 3
+# checks out and pulls every submodule on its own
+def sync(repos, branch = None, jobs = None, revert = True, mirror_home = None):
+    locks = []
 
-            cmd = command.command()
+    try:
+        for url, path in sorted(repos.values(), key = lambda x: os.path.abspath(x[1])):
+            repo_lock = lock(path)
 
-            for line in cmd.command(cmdline):
-                lines.append(line)
+            if not repo_lock.status:
+                return False
 
-                if display:
-                    print(line)
+            locks.append(repo_lock)
 
-                # if re.search(r'^\$\s+', line.strip()) or re.search(r'^in\s+\(.*\)$', line.strip()):
-                #     print(line)
+        return sync_repos(repos, branch, jobs, revert, mirror_home)
+    finally:
+        for repo_lock in reversed(locks):
+            repo_lock.release()
 
-            if cmd.result():
-                logs = []
+def sync_repos(repos, branch = None, jobs = None, revert = True, mirror_home = None):
+    changed()
 
-                info = None
-                comment = False
+    results = collections.OrderedDict()
 
-                git_home = home()
+    sched = scheduler.scheduler(jobs)
 
-                if not git_home:
-                    git_home = os.getcwd()
+    references = {}
 
-                for line in lines:
-                    line = line.rstrip()
+    for name, (url, path) in repos.items():
+        if not os.path.isdir(path):
+            reference = mirror_path(url, mirror_home)
 
-                    m = re.search(r'^commit\s+([0-9a-fA-F]+)$', line.strip())
+            if reference:
+                references[name] = reference
 
-                    if m:
-                        if info:
-                            logs.append(info)
+    # the mirrors are locked here, after the repositories, in path order as
+    # every other holder does
+    mirror_locks = {}
 
-                        info = {
-                          'revision': m.group(1),
-                          'author'  : None,
-                          'email'   : None,
-                          'date'    : None,
-                          'comment' : None,
-                          'changes' : None
-                        }
+    try:
+        for reference in sorted(set(references.values())):
+            mirror_locks[reference] = lock(reference)
 
-                        comment = False
+        mirrors = set()
 
-                        continue
+        for name, reference in list(references.items()):
+            if not mirror_locks[reference].status:
+                del references[name]
+            elif reference not in mirrors:
+                sched.add(name, mirror_cmdlines(reference, repos[name][0]), tags = 'network')
 
-                    m = re.search(r'^Author\s*:\s*(.*?)\s*<(.*?)>$', line.strip())
+                mirrors.add(reference)
 
-                    if m:
-                        info['author'] = m.group(1)
-                        info['email'] = m.group(2)
+        for name, result in sched.run().items():
+            if not result['status']:
+                for x in [x for x, reference in references.items() if reference == references[name]]:
+                    del references[x]
+    finally:
+        for mirror_lock in mirror_locks.values():
+            mirror_lock.release()
 
-                        continue
+    cloned = []
 
-                    m = re.search(r'^Date\s*:\s*', line.strip())
+    for name, (url, path) in repos.items():
+        if os.path.isdir(path):
+            cmdlines = []
 
-                    if m:
-                        try:
-                            info['date'] = datetime.datetime.strptime(m.string[m.end():], "%a %b %d %H:%M:%S %Y %z")
-                        except:
-                            pass
+            if revert:
+                cmdlines.append('git checkout -- .')
 
-                        comment = True
+            cmdlines.append('git pull')
 
-                        continue
+            sched.add(name, cmdlines, path, 'network')
+        else:
+            cmdline = 'git clone'
 
-                    m = re.search(r'\|\s+(\d+\s+([+-]*)|Bin\s+(\d+)\s+->\s+(\d+)\s+bytes)$', line.strip())
+            if branch:
+                cmdline += ' -b %s' % branch
 
-                    if m:
-                        name = m.string[:m.start()].strip()
+            if name in references:
+                cmdline += ' --reference "%s" --dissociate' % references[name]
 
-                        tmp_m = re.search(r'^\.{3}\/', name)
+            cmdline += ' %s %s' % (url, os.path.normpath(path))
 
-                        if tmp_m:
-                            with __os__.chdir(git_home) as chdir:
-                                for file in glob.iglob(os.path.join('**', tmp_m.string[tmp_m.end():]), recursive = True):
-                                    name = file
+            sched.add(name, cmdline, tags = 'network')
 
-                        if m.group(2):
-                            if '+' in m.group(2) and '-' in m.group(2):
-                                if not info['changes']:
-                                    info['changes'] = {}
+            cloned.append(name)
 
-                                if 'update' not in info['changes']:
-                                    info['changes']['update'] = []
+    results.update(sched.run())
 
-                                info['changes']['update'].append(name)
-                            else:
-                                if '+' in m.group(2):
-                                    if not info['changes']:
-                                        info['changes'] = {}
+    submodules = collections.OrderedDict()
 
-                                    if 'add' not in info['changes']:
-                                        info['changes']['add'] = []
+    for name, (url, path) in repos.items():
+        if not results[name]['status'] or not is_submodule(path):
+            continue
 
-                                    info['changes']['add'].append(name)
-                                else:
-                                    if not info['changes']:
-                                        info['changes'] = {}
+        cmdlines = []
 
-                                    if 'delete' not in info['changes']:
-                                        info['changes']['delete'] = []
+        if name in cloned:
+            cmdlines.append('git submodule init')
+        else:
+            if revert:
+                cmdlines.append('git submodule foreach git checkout -- .')
 
-                                    info['changes']['delete'].append(name)
-                        else:
-                            if m.group(3) == '0':
-                                if not info['changes']:
-                                    info['changes'] = {}
+        cmdlines.append('git submodule update')
 
-                                if 'add' not in info['changes']:
-                                    info['changes']['add'] = []
+        sched.add(name, cmdlines, path, 'network')
 
-                                info['changes']['add'].append(name)
-                            else:
-                                if m.group(4) == '0':
-                                    if not info['changes']:
-                                        info['changes'] = {}
+        submodules[name] = path
 
-                                    if 'delete' not in info['changes']:
-                                        info['changes']['delete'] = []
+    for name, result in sched.run().items():
+        sync_result(results[name], result)
 
-                                    info['changes']['delete'].append(name)
-                                else:
-                                    if not info['changes']:
-                                        info['changes'] = {}
+    names = {}
 
-                                    if 'update' not in info['changes']:
-                                        info['changes']['update'] = []
+    for name, path in submodules.items():
+        if not results[name]['status']:
+            continue
 
-                                    info['changes']['update'].append(name)
+        submodule_branch = 'master'
 
-                        comment = False
+        for key in config(path).keys():
+            m = re.search(r'^branch\.(.*)\.remote$', key)
 
-                        continue
+            if m:
+                submodule_branch = m.group(1)
 
-                    if comment:
-                        if line:
-                            if not info.get('comment'):
-                                info['comment'] = []
+                break
 
-                            info['comment'].append(line)
-                        else:
-                            if info.get('comment'):
-                                if info['comment'][-1]:
-                                    info['comment'].append(line)
+        for key, value in config(path, '-f .gitmodules').items():
+            if re.search(r'^submodule\..*\.path$', key):
+                jobname = '%s/%s' % (name, value)
 
-                        continue
+                sched.add(jobname, [
+                    'git checkout %s' % submodule_branch,
+                    'git pull'
+                ], os.path.join(path, value), 'network')
 
-                if info:
-                    logs.append(info)
+                names[jobname] = name
 
-                logs.reverse()
+    for jobname, result in sched.run().items():
+        sync_result(results[names[jobname]], result)
 
-                return logs
-            else:
-                return None
+    sched.puts_results(results)
+
+    status = True
+
+    for result in results.values():
+        if not result['status']:
+            status = False
+
+    return status
+
+# cone mode sparse checkout of the repository path limited to dirs (files at
+# the top level are always checked out), add widens the current cone instead
+# of replacing it. a partial clone (--filter=blob:none) fetches the blobs of
+# the cone on demand
+def sparse_checkout(path, dirs, add = False):
+    changed()
+
+    with lock(path) as repo_lock:
+        if not repo_lock.status:
+            return False
+
+        if not os.path.isdir(path):
+            print('no such directory: %s' % os.path.normpath(path))
+
+            return False
+
+        dirs = sorted(set(__os__.normpath(dir).strip('/') for dir in dirs if dir and __os__.normpath(dir) not in ('.', '')))
+
+        if add and not dirs:
+            return True
+
+        cmd = command.command()
+
+        if not is_sparse(path):
+            for line in cmd.command('git sparse-checkout init --cone', cwd = path):
+                print(line)
+
+            if not cmd.result():
+                return False
+
+        if add:
+            cmdline = 'git sparse-checkout add'
+        else:
+            cmdline = 'git sparse-checkout set'
+
+        for dir in dirs:
+            cmdline += ' "%s"' % dir
+
+        for line in cmd.command(cmdline, cwd = path):
+            print(line)
+
+        return cmd.result()
+
+def log(path = None, arg = None, display = False):
+    logs = []
+
+    cmd = command.command()
+
+    for info in iterlog(path, arg, display, cmd):
+        logs.append(info)
+
+    if cmd.result():
+        return logs
     else:
+        return None
+
+# log info:
+#   revision, author, email, date, comment, changes
+#
+#   changes:
+#       add     : []
+#       update  : []
+#       delete  : []
+#
+# commits are yielded one by one (oldest first) while git log is running,
+# parsed from `--pretty=raw --name-status`, paths are full paths relative
+# to the repository root
+def iterlog(path = None, arg = None, display = False, cmd = None):
+    if not path:
+        path = '.'
+
+    if not os.path.exists(path):
         print('no such file or directory: %s' % os.path.normpath(path))
 
-        return None
+        return
+
+    if os.path.isdir(path):
+        name = '.'
+    else:
+        name = os.path.basename(path)
+        path = os.path.dirname(path) or '.'
+
+    if arg:
+        arg = re.sub(r'--stat(=\S+)?', '', arg).strip()
+    else:
+        arg = '-1'
+
+    cmdline = 'git -c core.quotepath=off log --pretty=raw --name-status --no-renames --reverse %s -- %s' % (
+        arg, subprocess.list2cmdline([name]).strip())
+
+    if cmd is None:
+        cmd = command.command()
+
+    info = None
+    header = False
+
+    for index, line in enumerate(cmd.command(cmdline, cwd = path)):
+        if display:
+            print(line)
+
+        if index < 2:
+            continue
+
+        m = RE_LOG_COMMIT.search(line)
+
+        if m:
+            if info:
+                yield log_info(info)
+
+            info = {
+              'revision': m.group(1),
+              'author'  : None,
+              'email'   : None,
+              'date'    : None,
+              'comment' : None,
+              'changes' : None
+            }
+
+            header = True
+
+            continue
+
+        if info is None:
+            continue
+
+        if header:
+            if line:
+                m = RE_LOG_AUTHOR.search(line)
+
+                if m:
+                    info['author'] = m.group(1)
+                    info['email'] = m.group(2)
+                    info['date'] = log_date(m.group(3), m.group(4))
+            else:
+                header = False
+
+            continue
+
+        if line.startswith('    ') or not line:
+            if line:
+                if not info['comment']:
+                    info['comment'] = []
+
+                info['comment'].append(line)
+            else:
+                if info['comment'] and info['comment'][-1]:
+                    info['comment'].append(line)
+
+            continue
+
+        m = RE_LOG_STATUS.search(line)
+
+        if m:
+            name = log_path(m.group(2))
+
+            if m.group(1) in ('A', 'C'):
+                type = 'add'
+            elif m.group(1) in ('D',):
+                type = 'delete'
+            else:
+                type = 'update'
+
+            if not info['changes']:
+                info['changes'] = {}
+
+            if type not in info['changes']:
+                info['changes'][type] = []
+
+            info['changes'][type].append(name)
+
+    if info:
+        yield log_info(info)
 
 def info(path = None):
     map = None
@@ -305,55 +521,129 @@ def info(path = None):
     if logs:
         map = logs[-1]
 
-        conf = config(path)
+        url = remote_url(path)
 
-        if conf:
-            url = conf.get('remote.origin.url')
+        if url:
+            if path:
+                git_home = home(path)
 
-            if url:
-                m = re.search(r':\/\/(.*?)@', url)
+                if git_home:
+                    map['url'] = __os__.join(url, os.path.relpath(path, git_home))
+            else:
+                map['url'] = url
 
-                if m:
-                    url = '%s://%s' % (m.string[:m.start()], m.string[m.end():])
+    return map
+
+# bulk info() for many files, answered from the last commit index of each
+# repository, files missing in the index fall back to info()
+#
+# file:
+#   revision, author, email, date, url
+def infos(files):
+    map = collections.OrderedDict()
+
+    homes = collections.OrderedDict()
+
+    for file in files:
+        map[file] = None
 
-                if path:
-                    git_home = home(path)
+        git_home = home(file)
 
-                    if git_home:
-                        map['url'] = __os__.join(url, os.path.relpath(path, git_home))
+        if git_home:
+            if git_home not in homes:
+                homes[git_home] = []
+
+            homes[git_home].append(file)
+
+    for git_home, files in homes.items():
+        index = lastcommit.get(git_home)
+
+        if not index.update():
+            continue
+
+        url = remote_url(git_home)
+
+        for file, file_info in index.query(files).items():
+            if file_info:
+                if url:
+                    file_info['url'] = __os__.join(url, os.path.relpath(file, git_home))
                 else:
-                    map['url'] = url
+                    file_info['url'] = None
+
+                map[file] = file_info
+
+    for file in map:
+        if map[file] is None:
+            file_info = info(file)
+
+            if file_info:
+                file_info.setdefault('url', None)
+
+            map[file] = file_info
+
+    return map
+
+# bulk line owners of files, answered from the blame cache of each repository
+#
+#   files : file -> [lineno, ...]
+#
+# file:
+#   lineno: revision, author, email, date (None for uncommitted lines)
+def blames(files):
+    map = collections.OrderedDict()
+
+    for file, linenos in files.items():
+        map[file] = collections.OrderedDict()
+
+        git_home = home(file)
+
+        if not git_home:
+            continue
+
+        owners = blame.get(git_home).query(file)
+
+        if owners is None:
+            continue
+
+        for lineno in linenos:
+            map[file][lineno] = owners(lineno)
 
     return map
 
 def reset(path = None, branch = None):
+    changed()
+
     if not path:
         path = '.'
 
     if not branch:
         branch = 'master'
 
-    if os.path.isdir(path):
-        with __os__.chdir(path) as chdir:
-            cmd = command.command()
+    with lock(path) as repo_lock:
+        if not repo_lock.status:
+            return False
 
-            for line in cmd.command('git checkout -f -B %s' % branch):
-                print(line)
+        if os.path.isdir(path):
+            with __os__.chdir(path) as chdir:
+                cmd = command.command()
 
-            if not cmd.result():
-                return False
+                for line in cmd.command('git checkout -f -B %s' % branch):
+                    print(line)
 
-            for line in cmd.command('git reset --hard origin/%s' % branch):
-                print(line)
+                if not cmd.result():
+                    return False
 
-            if not cmd.result():
-                return False
+                for line in cmd.command('git reset --hard origin/%s' % branch):
+                    print(line)
 
-            return True
-    else:
-        print('no such directory: %s' % os.path.normpath(path))
+                if not cmd.result():
+                    return False
 
-        return False
+                return True
+        else:
+            print('no such directory: %s' % os.path.normpath(path))
+
+            return False
 
 def config(path = None, arg = None):
     if not path:
@@ -365,6 +655,19 @@ def config(path = None, arg = None):
     conf = {}
 
     if os.path.isdir(path):
+        git_home = None
+
+        if not arg:
+            git_home = home(path)
+
+            if git_home:
+                stamp = metadata_stamp(git_home)
+
+                cache = METADATA.get(git_home)
+
+                if cache and cache['stamp'] == stamp:
+                    return dict(cache['config'])
+
         cmdline = 'git config'
 
         if arg:
@@ -386,6 +689,13 @@ def config(path = None, arg = None):
 
                     if m:
                         conf[m.string[:m.start()]] = m.string[m.end():]
+
+                if git_home:
+                    METADATA[git_home] = {
+                        'stamp' : stamp,
+                        'config': dict(conf),
+                        'url'   : normalize_url(conf.get('remote.origin.url'))
+                    }
     else:
         print('no such directory: %s' % os.path.normpath(path))
 
@@ -400,19 +710,907 @@ def home(path = None):
     if os.path.isfile(path):
         path = os.path.dirname(path)
 
-    if os.path.isdir(path):
-        if os.path.isdir(os.path.join(path, '.git')):
-            return path
+    if not os.path.isdir(path):
+        return None
+
+    dirs = []
+
+    while True:
+        git_home = HOMES.get(path)
+
+        if git_home:
+            if os.path.exists(os.path.join(git_home, '.git')):
+                break
+
+            HOMES.pop(path, None)
+
+        if os.path.exists(os.path.join(path, '.git')):
+            git_home = path
+
+            break
+
+        dirs.append(path)
+
+        if os.path.dirname(path) == path:
+            return None
+
+        path = os.path.dirname(path)
+
+    for dir in dirs + [path]:
+        HOMES[dir] = git_home
+
+    return git_home
+
+# last commit of every file of a repository, persisted in .git/pyant and
+# updated incrementally from the last indexed HEAD
+#
+#   files:
+#       path: [revision, author, email, date]
+class lastcommit:
+    indexes = {}
+
+    def __init__(self, path):
+        self.path = path
+        self.file = os.path.join(git_dir(path), 'pyant', 'lastcommit.json')
+
+        self.head = None
+        self.files = {}
+
+        self.load()
+
+    @staticmethod
+    def get(path):
+        path = os.path.abspath(path)
+
+        if path not in lastcommit.indexes:
+            lastcommit.indexes[path] = lastcommit(path)
+
+        return lastcommit.indexes[path]
+
+    def update(self):
+        head = rev_parse('HEAD', self.path)
+
+        if not head:
+            return False
+
+        if head == self.head:
+            return True
+
+        if self.head and is_ancestor(self.head, head, self.path):
+            arg = '%s..%s' % (self.head, head)
         else:
-            if os.path.dirname(path) == path:
+            arg = head
+
+            self.files = {}
+
+        cmd = command.command()
+
+        for info in iterlog(self.path, arg, False, cmd):
+            if info['changes']:
+                date = None
+
+                if info['date']:
+                    date = info['date'].strftime('%Y-%m-%d %H:%M:%S %z')
+
+                for type, files in info['changes'].items():
+                    for file in files:
+                        if type == 'delete':
+                            self.files.pop(file, None)
+                        else:
+                            self.files[file] = [info['revision'], info['author'], info['email'], date]
+
+        if not cmd.result():
+            return False
+
+        self.head = head
+        self.save()
+
+        return True
+
+    def query(self, files):
+        map = collections.OrderedDict()
+
+        for file in files:
+            name = __os__.normpath(os.path.relpath(os.path.abspath(file), self.path))
+
+            if name in self.files:
+                revision, author, email, date = self.files[name]
+
+                if date:
+                    try:
+                        date = datetime.datetime.strptime(date, '%Y-%m-%d %H:%M:%S %z')
+                    except:
+                        date = None
+
+                map[file] = {
+                    'revision': revision,
+                    'author'  : author,
+                    'email'   : email,
+                    'date'    : date,
+                    'comment' : None,
+                    'changes' : None
+                }
+            else:
+                map[file] = None
+
+        return map
+
+    def load(self):
+        if os.path.isfile(self.file):
+            try:
+                with open(self.file, encoding = 'utf8') as f:
+                    data = json.load(f)
+
+                self.head = data['head']
+                self.files = data['files']
+            except:
+                self.head = None
+                self.files = {}
+
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(self.file), exist_ok = True)
+
+            write_json(self.file, {'head': self.head, 'files': self.files})
+        except Exception as e:
+            print(e)
+
+# line owners of the working files of a repository from `git blame
+# --incremental`, cached in .git/pyant/blame per path and blob hash, so a file
+# is blamed again only when its content changes. files differing from HEAD
+# are not cached, the cache is bounded by BLAME_CACHE_SIZE
+#
+#   blob.json:
+#       path    : relative path
+#       lines   : [[start, count, revision], ...]
+#       commits : revision -> [author, email, date]
+class blame:
+    indexes = {}
+
+    def __init__(self, path):
+        self.path = path
+        self.dir = os.path.join(common_dir(path), 'pyant', 'blame')
+        self.evicted = False
+
+    @staticmethod
+    def get(path):
+        path = os.path.abspath(path)
+
+        if path not in blame.indexes:
+            blame.indexes[path] = blame(path)
+
+        return blame.indexes[path]
+
+    # function lineno -> owner info, or None
+    def query(self, file):
+        try:
+            with open(file, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+
+        name = __os__.normpath(os.path.relpath(os.path.abspath(file), self.path))
+        blob = hashlib.sha1(b'blob %d\0' % len(data) + data).hexdigest()
+
+        entry = self.load(blob, name)
+
+        if entry is None:
+            entry = self.run(name)
+
+            if entry is None:
+                return None
+
+            # the blame of a modified file covers uncommitted lines
+            if rev_parse('HEAD:%s' % name, self.path) == blob:
+                self.save(blob, entry)
+
+        starts = [x[0] for x in entry['lines']]
+        commits = entry['commits']
+
+        def owner(lineno):
+            index = bisect.bisect_right(starts, lineno) - 1
+
+            if index < 0:
                 return None
+
+            start, count, revision = entry['lines'][index]
+
+            if lineno >= start + count or revision not in commits:
+                return None
+
+            author, email, date = commits[revision]
+
+            if date:
+                try:
+                    date = datetime.datetime.strptime(date, '%Y-%m-%d %H:%M:%S %z')
+                except:
+                    date = None
+
+            return {
+                'revision': revision,
+                'author'  : author,
+                'email'   : email,
+                'date'    : date
+            }
+
+        return owner
+
+    def run(self, name):
+        lines = []
+        commits = {}
+
+        revision = None
+        commit = None
+
+        cmd = command.command()
+
+        for index, line in enumerate(cmd.command('git blame --incremental -- %s' % subprocess.list2cmdline([name]), cwd = self.path)):
+            if index < 2:
+                continue
+
+            m = RE_BLAME_HEADER.search(line)
+
+            if m:
+                revision = m.group(1)
+                lines.append([int(m.group(3)), int(m.group(4)), revision])
+
+                if revision not in commits and revision.strip('0'):
+                    commit = commits[revision] = {}
+                else:
+                    commit = None
+
+                continue
+
+            if commit is not None:
+                key, _, value = line.partition(' ')
+
+                if key in ('author', 'author-mail', 'author-time', 'author-tz'):
+                    commit[key] = value
+
+        if not cmd.result():
+            return None
+
+        lines.sort()
+
+        for revision, commit in commits.items():
+            date = None
+
+            if commit.get('author-time') and commit.get('author-tz'):
+                date = log_date(commit['author-time'], commit['author-tz'])
+
+                if date:
+                    date = date.strftime('%Y-%m-%d %H:%M:%S %z')
+
+            commits[revision] = [commit.get('author'), commit.get('author-mail', '').strip('<>') or None, date]
+
+        return {
+            'path'   : name,
+            'lines'  : lines,
+            'commits': commits
+        }
+
+    def load(self, blob, name):
+        file = os.path.join(self.dir, '%s.json' % blob)
+
+        if os.path.isfile(file):
+            try:
+                with open(file, encoding = 'utf8') as f:
+                    entry = json.load(f)
+
+                if entry['path'] == name:
+                    os.utime(file)
+
+                    return entry
+            except:
+                pass
+
+        return None
+
+    def save(self, blob, entry):
+        file = os.path.join(self.dir, '%s.json' % blob)
+
+        try:
+            os.makedirs(self.dir, exist_ok = True)
+
+            write_json(file, entry)
+        except Exception as e:
+            print(e)
+
+            return
+
+        # once per process, the directory is listed for it
+        if not self.evicted:
+            self.evicted = True
+            self.evict()
+
+    def evict(self):
+        files = []
+        total = 0
+
+        for name in os.listdir(self.dir):
+            if name.endswith('.json'):
+                file = os.path.join(self.dir, name)
+
+                try:
+                    st = os.stat(file)
+                except OSError:
+                    continue
+
+                files.append((st.st_mtime, st.st_size, file))
+                total += st.st_size
+
+        files.sort()
+
+        for mtime, size, file in files:
+            if total <= BLAME_CACHE_SIZE:
+                break
+
+            try:
+                os.remove(file)
+
+                total -= size
+            except OSError:
+                pass
+
+# cross process lock of the repository path (or of the directory a clone
+# goes to), held by clone(), pull(), reset() and sync(). waiting jobs poll the
+# lock until timeout, the lock is reentrant in the thread holding it
+#
+#   with git.lock(path) as repo_lock:
+#       if repo_lock.status:
+#           ...
+class lock:
+    held = {}
+    held_lock = threading.Lock()
+
+    def __init__(self, path, timeout = None):
+        self.path = os.path.abspath(path)
+        self.file = os.path.join(os.path.dirname(self.path), '.%s.lock' % os.path.basename(self.path))
+
+        if timeout is None:
+            timeout = LOCK_TIMEOUT
+
+        self.timeout = timeout
+        self.fd = None
+
+        self.status = self.acquire()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.release()
+
+    def acquire(self):
+        key = (self.file, threading.get_ident())
+
+        with lock.held_lock:
+            if key in lock.held:
+                lock.held[key] += 1
+
+                return True
+
+        os.makedirs(os.path.dirname(self.file), exist_ok = True)
+
+        fd = os.open(self.file, os.O_RDWR | os.O_CREAT, 0o666)
+
+        t = time.time()
+        waiting = False
+
+        while True:
+            try:
+                if os.name == 'nt':
+                    msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                else:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+                break
+            except OSError:
+                if time.time() - t >= self.timeout:
+                    os.close(fd)
+
+                    print('lock timeout after %s seconds: %s' % (self.timeout, os.path.normpath(self.path)))
+
+                    return False
+
+                if not waiting:
+                    print('waiting for lock: %s' % os.path.normpath(self.path))
+
+                    waiting = True
+
+                time.sleep(0.5)
+
+        if waiting:
+            print('lock acquired after %.1f seconds: %s' % (time.time() - t, os.path.normpath(self.path)))
+
+        self.fd = fd
+
+        with lock.held_lock:
+            lock.held[key] = 1
+
+        index_lock = os.path.join(git_dir(self.path), 'index.lock')
+
+        try:
+            if time.time() - os.path.getmtime(index_lock) > INDEX_LOCK_STALE:
+                os.remove(index_lock)
+
+                print('remove stale lock: %s' % os.path.normpath(index_lock))
+        except OSError:
+            pass
+
+        return True
+
+    def release(self):
+        if not self.status:
+            return
+
+        self.status = False
+
+        key = (self.file, threading.get_ident())
+
+        with lock.held_lock:
+            lock.held[key] -= 1
+
+            if lock.held[key]:
+                return
+
+            del lock.held[key]
+
+        if self.fd is not None:
+            try:
+                if os.name == 'nt':
+                    os.lseek(self.fd, 0, os.SEEK_SET)
+                    msvcrt.locking(self.fd, msvcrt.LK_UNLCK, 1)
+                else:
+                    fcntl.flock(self.fd, fcntl.LOCK_UN)
+            finally:
+                os.close(self.fd)
+
+                self.fd = None
+
+# detached worktree of the repository path at revision, sharing the object
+# store of path, in a directory of its own under <parent>/.worktree (or
+# worktree_path), removed on exit
+#
+#   with git.worktree(path, revision) as tree:
+#       if tree.status:
+#           with __os__.chdir(tree.path) as chdir:
+#               ...
+class worktree:
+    def __init__(self, path, revision, worktree_path = None):
+        self.home = os.path.abspath(path)
+        self.revision = revision
+
+        self.path = worktree_path
+
+        if self.path:
+            self.path = os.path.abspath(self.path)
+
+        self.status = self.add()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.remove()
+
+    def add(self):
+        if self.path:
+            if os.path.exists(self.path):
+                self.remove()
+
+            os.makedirs(os.path.dirname(self.path), exist_ok = True)
+        else:
+            # a path of its own, a verification of the same patchset may run
+            # next to it
+            dirname = os.path.join(os.path.dirname(self.home), '.worktree')
+
+            os.makedirs(dirname, exist_ok = True)
+
+            self.path = tempfile.mkdtemp(prefix = '%s_%s_' % (os.path.basename(self.home), self.revision[:12]), dir = dirname)
+
+        cmd = command.command()
+
+        for line in cmd.command('git worktree add --detach -f "%s" %s' % (self.path, self.revision), cwd = self.home):
+            print(line)
+
+        return cmd.result()
+
+    def remove(self):
+        cmd = command.command()
+
+        for line in cmd.command('git worktree remove --force "%s"' % self.path, cwd = self.home):
+            print(line)
+
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path, ignore_errors = True)
+
+        for line in cmd.command('git worktree prune', cwd = self.home):
+            print(line)
+
+        for key in [key for key in HOMES if HOMES[key] == self.path]:
+            del HOMES[key]
+
+        METADATA.pop(self.path, None)
+        lastcommit.indexes.pop(self.path, None)
+
+        reader = catfile.readers.pop(self.path, None)
+
+        if reader:
+            reader.close()
+
+# long lived `git cat-file --batch` and `--batch-check` processes of a
+# repository, every query is one round trip on the pipe
+#
+#   reader = catfile.get(path)
+#   reader.check('HEAD')                    sha, type, size
+#   reader.blob('HEAD:pom/pom.xml')         bytes
+#   reader.tree('HEAD:pom')                 [mode, type, sha, name]
+#   reader.commit('HEAD~1')                 revision, tree, parents, author, email, date, comment
+class catfile:
+    readers = {}
+    readers_lock = threading.Lock()
+
+    def __init__(self, path):
+        self.path = path
+
+        self.pipes = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get(path = None):
+        git_home = home(path)
+
+        if not git_home:
+            return None
+
+        with catfile.readers_lock:
+            if git_home not in catfile.readers:
+                catfile.readers[git_home] = catfile(git_home)
+
+            return catfile.readers[git_home]
+
+    def check(self, name):
+        with self.lock:
+            return self.request('--batch-check', name)
+
+    # sha, type, size, data
+    def read(self, name):
+        with self.lock:
+            header = self.request('--batch', name)
+
+            if header:
+                stdout = self.pipes['--batch'].stdout
+
+                header['data'] = stdout.read(header['size'])
+                stdout.read(1)
+
+            return header
+
+    def blob(self, name):
+        object = self.read(name)
+
+        if object and object['type'] == 'blob':
+            return object['data']
+
+        return None
+
+    def tree(self, name):
+        object = self.read(name)
+
+        if object and object['type'] == 'commit':
+            object = self.read('%s^{tree}' % name)
+
+        if not object or object['type'] != 'tree':
+            return None
+
+        entries = []
+
+        data = object['data']
+        size = len(object['sha']) // 2
+
+        pos = 0
+
+        while pos < len(data):
+            end = data.index(b'\0', pos)
+
+            mode, filename = data[pos:end].decode('utf8', 'replace').split(' ', 1)
+            sha = data[end + 1:end + 1 + size].hex()
+
+            if mode == '40000':
+                type = 'tree'
+            elif mode == '160000':
+                type = 'commit'
             else:
-                return home(os.path.dirname(path))
-    else:
+                type = 'blob'
+
+            entries.append((mode, type, sha, filename))
+
+            pos = end + 1 + size
+
+        return entries
+
+    def commit(self, name):
+        object = self.read(name)
+
+        if not object or object['type'] != 'commit':
+            return None
+
+        info = {
+            'revision': object['sha'],
+            'tree'    : None,
+            'parents' : [],
+            'author'  : None,
+            'email'   : None,
+            'date'    : None,
+            'comment' : []
+        }
+
+        headers, _, message = object['data'].decode('utf8', 'replace').partition('\n\n')
+
+        for line in headers.splitlines():
+            if line.startswith('tree '):
+                info['tree'] = line[5:]
+            elif line.startswith('parent '):
+                info['parents'].append(line[7:])
+            else:
+                m = RE_LOG_AUTHOR.search(line)
+
+                if m:
+                    info['author'], info['email'] = m.group(1), m.group(2)
+                    info['date'] = log_date(m.group(3), m.group(4))
+
+        info['comment'] = message.splitlines()
+
+        return log_info(info)
+
+    def close(self):
+        with self.lock:
+            for pipe in self.pipes.values():
+                try:
+                    pipe.stdin.close()
+                    pipe.wait()
+                except:
+                    pass
+
+            self.pipes = {}
+
+    def request(self, option, name):
+        if not name or '\n' in name:
+            return None
+
+        for retry in range(2):
+            pipe = self.pipes.get(option)
+
+            if pipe is None or pipe.poll() is not None:
+                pipe = subprocess.Popen(['git', 'cat-file', option], stdin = subprocess.PIPE,
+                    stdout = subprocess.PIPE, stderr = subprocess.DEVNULL, cwd = self.path
+                )
+
+                self.pipes[option] = pipe
+
+            try:
+                pipe.stdin.write(name.encode('utf8') + b'\n')
+                pipe.stdin.flush()
+
+                line = pipe.stdout.readline()
+            except (BrokenPipeError, OSError):
+                line = b''
+
+            if line:
+                break
+
+            self.pipes.pop(option, None)
+        else:
+            return None
+
+        fields = line.decode('utf8', 'replace').split()
+
+        if len(fields) == 3 and fields[2].isdigit() and fields[1] in ('blob', 'tree', 'commit', 'tag'):
+            return {
+                'sha' : fields[0],
+                'type': fields[1],
+                'size': int(fields[2])
+            }
+
         return None
 
 # ----------------------------------------------------------
 
+def rev_parse(rev, path = None):
+    reader = catfile.get(path)
+
+    if reader:
+        object = reader.check(rev)
+
+        if object:
+            return object['sha']
+
+    return None
+
+def is_ancestor(rev, descendant, path = None):
+    cmd = command.command()
+
+    for line in cmd.command('git merge-base --is-ancestor %s %s' % (rev, descendant), cwd = path):
+        pass
+
+    return cmd.result()
+
+def remote_url(path = None):
+    git_home = home(path)
+
+    if git_home:
+        cache = METADATA.get(git_home)
+
+        if cache and cache['stamp'] == metadata_stamp(git_home):
+            return cache['url']
+
+    return normalize_url(config(path).get('remote.origin.url'))
+
+def normalize_url(url):
+    if url:
+        m = re.search(r':\/\/(.*?)@', url)
+
+        if m:
+            url = '%s://%s' % (m.string[:m.start()], m.string[m.end():])
+
+    return url
+
+# repository metadata shared by every caller of the process
+#
+#   HOMES    : directory -> repository home
+#   METADATA : repository home -> stamp, config, url
+#
+# a METADATA entry is valid as long as .git/config and .git/HEAD are unchanged
+HOMES = {}
+METADATA = {}
+
+# bumped by every call rewriting working trees (clone, pull, sync, reset,
+# sparse_checkout), caches of working tree contents compare it
+CHANGES = 0
+
+def changed():
+    global CHANGES
+
+    CHANGES += 1
+
+def metadata_stamp(git_home):
+    stamp = []
+
+    for file in (os.path.join(common_dir(git_home), 'config'), os.path.join(git_dir(git_home), 'HEAD')):
+        try:
+            st = os.stat(file)
+
+            stamp.append((st.st_mtime_ns, st.st_size))
+        except OSError:
+            stamp.append(None)
+
+    return tuple(stamp)
+
+# .git of git_home, or the directory named by the `gitdir:` line when .git
+# is a file (worktree, submodule)
+def git_dir(git_home):
+    path = os.path.join(git_home, '.git')
+
+    if os.path.isfile(path):
+        try:
+            with open(path, encoding = 'utf8') as f:
+                m = re.search(r'^gitdir:\s*(.*?)\s*$', f.read(), re.M)
+
+            if m:
+                return os.path.normpath(os.path.join(git_home, m.group(1)))
+        except OSError:
+            pass
+
+    return path
+
+# git_dir() shared by all worktrees of the repository (config, objects, refs)
+def common_dir(git_home):
+    path = git_dir(git_home)
+
+    try:
+        with open(os.path.join(path, 'commondir'), encoding = 'utf8') as f:
+            return os.path.normpath(os.path.join(path, f.read().strip()))
+    except OSError:
+        return path
+
+RE_LOG_COMMIT = re.compile(r'^commit\s+([0-9a-fA-F]+)')
+RE_LOG_AUTHOR = re.compile(r'^author\s+(.*?)\s*<(.*?)>\s+(\d+)\s+([+-]\d{4})$')
+RE_LOG_STATUS = re.compile(r'^([A-Z])\d*\t(.*)$')
+RE_BLAME_HEADER = re.compile(r'^([0-9a-fA-F]{40,64})\s+(\d+)\s+(\d+)\s+(\d+)$')
+
+def log_info(info):
+    if info['comment']:
+        while info['comment'] and not info['comment'][-1]:
+            info['comment'].pop()
+
+    return info
+
+def log_date(timestamp, tz):
+    try:
+        offset = datetime.timedelta(hours = int(tz[1:3]), minutes = int(tz[3:5]))
+
+        if tz.startswith('-'):
+            offset = -offset
+
+        return datetime.datetime.fromtimestamp(int(timestamp), datetime.timezone(offset))
+    except:
+        return None
+
+# "a\tb.java" -> a<tab>b.java, git quotes paths with special characters
+def log_path(name):
+    if name.startswith('"') and name.endswith('"'):
+        try:
+            return codecs.escape_decode(name[1:-1])[0].decode('utf8')
+        except:
+            return name[1:-1]
+    else:
+        return name
+
+# mirror of url under mirror_home (default MIRROR_HOME), None without mirrors
+def mirror_path(url, mirror_home = None):
+    if not mirror_home:
+        mirror_home = MIRROR_HOME
+
+    if not mirror_home:
+        return None
+
+    name = re.sub(r'^[\w+.-]+:\/\/', '', normalize_url(url))
+    name = re.sub(r'[:@]', '_', name).strip('/')
+
+    if not name.endswith('.git'):
+        name += '.git'
+
+    return os.path.abspath(os.path.join(mirror_home, *name.split('/')))
+
+# cmdlines creating or refreshing the mirror path of url, only branches and
+# tags are mirrored (no gerrit refs/changes), run them under lock(path)
+def mirror_cmdlines(path, url):
+    if os.path.isdir(path):
+        cmdlines = [
+            'git --git-dir="%s" fetch --prune --tags origin' % path
+        ]
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+
+        cmdlines = [
+            'git clone --bare %s "%s"' % (url, path),
+            'git --git-dir="%s" config remote.origin.fetch "+refs/heads/*:refs/heads/*"' % path
+        ]
+
+    return cmdlines
+
+def sync_result(result, next):
+    if next:
+        result['time'] += next['time']
+
+        if result['status'] and not next['status']:
+            result['status'] = False
+            result['returncode'] = next['returncode']
+            result['cmdline'] = next['cmdline']
+
+# json of data in file, written to a temporary file of the same directory
+# first, so concurrent writers never share one
+def write_json(file, data):
+    fd, tmpfile = tempfile.mkstemp(suffix = '.tmp', dir = os.path.dirname(file))
+
+    try:
+        with os.fdopen(fd, 'w', encoding = 'utf8') as f:
+            json.dump(data, f, ensure_ascii = False)
+
+        os.chmod(tmpfile, 0o644)
+        os.replace(tmpfile, file)
+    except:
+        try:
+            os.remove(tmpfile)
+        except OSError:
+            pass
+
+        raise
+
+def is_sparse(path = None):
+    return config(path).get('core.sparsecheckout') == 'true'
+
 def is_submodule(path = None):
     if not path:
         path = '.'
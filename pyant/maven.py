@@ -1,42 +1,125 @@
 import collections
-import glob
+import concurrent.futures
 import os
 import re
+import shutil
 import tempfile
 
-from lxml import etree
-
-from pyant import command, git, smtp
+from pyant import command, git, pom, smtp
 from pyant.builtin import __os__, __string__
 
-__all__ = ('maven',)
+__all__ = ('maven', 'analyzer', 'sources')
 
 class maven:
     def __init__(self):
         self.path = os.getcwd()
         self.errors = None
         self.lines = []
+        self.analyzer = None
 
-        self.module_name = None
-        self.module_home = os.getcwd()
-
-        self.summary = False
         self.notification = '<BUILD 通知>编译失败, 请尽快处理'
 
+    # target directories of the reactor removed in parallel. mvn clean when a
+    # pom.xml of the workspace, the module or one of its parents, may change
+    # what clean removes (maven-clean-plugin, <build><directory>, profiles);
+    # the parents outside the workspace are taken to clean target
     def clean(self):
         self.errors = None
         self.lines = []
+        self.analyzer = None
 
-        status = None
+        dirnames = self.clean_dirs()
 
-        cmd = command.command()
+        if dirnames is None:
+            return self.clean_mvn()
+
+        status = True
+
+        with concurrent.futures.ThreadPoolExecutor(min(len(dirnames), 16) or 1) as executor:
+            for dirname, error in zip(dirnames, executor.map(self.rmtree, dirnames)):
+                print('[INFO] Deleting %s' % dirname)
+
+                if error:
+                    print('[ERROR] %s' % error)
+
+                    status = False
+
+        return status
+
+    def clean_dirs(self):
+        poms = pom.index.get('.')
+        modules = poms.reactor('.')
+
+        if not modules:
+            return None
+
+        # artifactid -> entries of the workspace
+        entries = {}
+
+        for entry in poms.poms.values():
+            entries.setdefault(entry['artifactid'], []).append(entry)
+
+        dirnames = []
+
+        for info in modules.values():
+            entry = poms.poms[info['path']]
+            artifactids = set()
+
+            while entry:
+                if entry.get('directory') or entry.get('cleanplugin') or entry.get('profiles'):
+                    return None
+
+                if not entry['parent']:
+                    break
+
+                artifactids.add(entry['artifactid'])
+
+                if entry['parent'] in artifactids:
+                    return None
+
+                entry = self.clean_parent(entry, entries)
+
+                if entry is False:
+                    return None
+
+            dirname = os.path.join(info['path'], 'target')
 
-        for line in cmd.command('mvn clean -fn -U'):
-            status = self.validate(status, line)
+            if os.path.isdir(dirname):
+                dirnames.append(dirname)
 
-            if not self.ignore(line):
+        return dirnames
+
+    # the parent pom of entry in the workspace: at its <relativePath> (a
+    # sibling repository as well), or the only one of the index with its
+    # artifactid. None outside the workspace, False if ambiguous
+    def clean_parent(self, entry, entries):
+        if entry.get('parentpath') and os.path.isfile(os.path.join(entry['parentpath'], 'pom.xml')):
+            parent = pom.index.get(entry['parentpath']).poms.get(entry['parentpath'])
+
+            if parent and parent['artifactid'] == entry['parent']:
+                return parent
+
+        parents = entries.get(entry['parent'], ())
+
+        if len(parents) > 1:
+            return False
+
+        if parents:
+            return parents[0]
+        else:
+            return None
+
+    def clean_mvn(self):
+        lines = analyzer()
+
+        cmd = command.command()
+
+        for line in cmd.command('mvn clean -fn'):
+            if not lines.feed(line):
                 print(line)
 
+        status = lines.status
+
         if not cmd.result():
             status = False
 
@@ -47,23 +130,24 @@ class maven:
             cmdline = 'mvn install -fn -U'
 
         self.errors = None
-        self.lines = []
-
-        status = None
+        self.lines = command.capture()
+        self.analyzer = analyzer(lang)
 
         cmd = command.command()
 
-        for line in cmd.command(cmdline):
+        for line in cmd.command(cmdline, tee = self.logfile()):
             self.lines.append(line)
 
-            status = self.validate(status, line)
+            ignore = self.analyzer.feed(line)
 
             if retry_cmd:
-                if not self.ignore(line):
+                if not ignore:
                     print(line)
             else:
                 print(line)
 
+        status = self.analyzer.status
+
         if not cmd.result():
             status = False
 
@@ -79,10 +163,7 @@ class maven:
                     modules = self.retry_modules()
 
                 if modules:
-                    with __os__.tmpdir('tmp') as tmpdir:
-                        self.retry_pom(modules, '../pom.xml')
-
-                        return self.retry_compile(retry_cmd, lang)
+                    return self.retry_compile('%s -pl %s' % (retry_cmd, ','.join(modules.values())), lang)
                 else:
                     return self.retry_compile(retry_cmd, lang)
             else:
@@ -92,720 +173,763 @@ class maven:
 
                 return False
 
+    def rmtree(self, path):
+        try:
+            shutil.rmtree(path)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            return str(e)
+
+        return None
+
     def artifactid_paths(self, dirname):
         if not dirname:
             dirname = '.'
 
         map = {}
 
-        if os.path.isfile(os.path.join(dirname, 'pom.xml')):
-            with __os__.chdir(dirname) as chdir:
-                try:
-                    tree = etree.parse('pom.xml')
-                    namespace = tree.getroot().nsmap
-
-                    e = tree.find('/artifactId', namespace)
-
-                    if e is not None:
-                        map[self.artifactid_prefix(e.text.strip())] = os.getcwd()
-
-                    for e in tree.findall('//modules/module', namespace):
-                        module_path = e.text.strip()
-
-                        if module_path:
-                            for k, v in self.artifactid_paths(module_path).items():
-                                map[k] = v
-                except:
-                    pass
+        for artifactid, info in pom.reactor(dirname).items():
+            map[artifactid] = info['path']
 
         return map
 
     # ----------------------------------------------------------
 
-    def ignore(self, line):
-        line = line.strip()
-
-        if re.search(r'^\$\s+', line):
-            return False
-
-        if re.search(r'^in\s+\(.*\)$', line):
-            return False
+    def set_errors(self, lang = None):
+        if self.analyzer is None or self.analyzer.lang != lang:
+            self.analyzer = analyzer(lang)
 
-        if re.search(r'^\[INFO\]\s+Reactor\s+Summary:$', line):
-            self.summary = True
+            for line in self.lines:
+                self.analyzer.feed(line)
 
-        if self.summary:
-            if re.search(r'^\[INFO\]\s+Final\s+Memory:', line):
-                self.summary = False
+        self.errors = self.analyzer.finish()
 
-            return False
-        else:
-            if re.search(r'^\[INFO\]\s+-+$', line):
-                return False
-            elif re.search(r'^\[INFO\]\s+Building\s+', line):
-                if re.search(r'^\[INFO\]\s+Building\s+(jar|war|zip)\s*:', line):
-                    return True
-                else:
-                    return False
-            elif re.search(r'^\[INFO\]\s+BUILD\s+(SUCCESS|FAILURE)$', line):
-                return False
-            elif re.search(r'\[(ERROR|EXCEPTION)\]', line):
-                return False
-            elif re.search(r'http:\/\/', line):
-                return True
-            elif re.search(r'\[exec\].*\s+(error|errors)\s+', line):
-                return False
-            elif re.search(r'\:.*\s+(error|errors)\s+', line):
-                if 'following dependencies:' in line:
-                    return True
-                else:
-                    return False
-            else:
-                return True
+        if self.errors:
+            artifactids = {}
 
-    def validate(self, status, line):
-        m = re.search(r'^\[INFO\]\s+BUILD\s+(SUCCESS|FAILURE)$', line.strip())
+            for file in list(self.errors.keys()):
+                if file:
+                    found = False
 
-        if m:
-            if m.group(1) == 'SUCCESS':
-                if status is None:
-                    return True
-                else:
-                    return status
-            else:
-                return False
-        else:
-            return status
+                    tmp_file = __os__.normpath(file)
 
-    def set_errors(self, lang = None):
-        self.errors = None
+                    for name in ('target/', 'output/'):
+                        if name in tmp_file:
+                            found = True
 
-        self.module_name = None
-        self.module_home = os.getcwd()
+                            break
 
-        start = None
-        logs = {}
+                    if found:
+                        del self.errors[file]
 
-        for index, line in enumerate(self.lines):
-            line = line.strip()
+                        continue
 
-            m = re.search(r'^\[INFO\]\s+Building\s+', line)
+                    if os.path.isdir(file):
+                        dirname = file
+                    else:
+                        dirname = os.path.dirname(file)
 
-            if m:
-                start = True
+                    if dirname not in artifactids:
+                        artifactids[dirname] = self.artifactid(file)
 
-                if self.module_name:
-                    if index > 1:
-                        logs[self.module_name][-1] = index - 2
-                    else:
-                        logs[self.module_name][-1] = index
+                    artifact_id = artifactids[dirname]
 
-                self.module_name = m.string[m.end():].split()[0]
+                    if artifact_id:
+                        logs_info = self.analyzer.logs.get(artifact_id)
 
-                if index > 0:
-                    logs[self.module_name] = [index - 1, -1]
-                else:
-                    logs[self.module_name] = [index, -1]
+                        if logs_info:
+                            self.errors[file]['logs'] = self.lines[logs_info[0]:logs_info[-1]]
 
-                continue
+            infos = git.infos([file for file in self.errors if file])
 
-            m = re.search(r'^\[INFO\]\s+BUILD\s+(SUCCESS|FAILURE)$', line)
+            files = collections.OrderedDict()
 
-            if m:
-                start = False
+            for file in self.errors:
+                if file:
+                    linenos = [lineno for lineno in self.errors[file]['message'] if lineno]
 
-                if self.module_name:
-                    if logs[self.module_name][-1] == -1:
-                        if index > 0:
-                            logs[self.module_name][-1] = index - 1
-                        else:
-                            logs[self.module_name][-1] = index
+                    if linenos:
+                        files[file] = linenos
 
-                    self.module_name = None
+            blames = git.blames(files)
 
-                continue
+            for file in self.errors:
+                if file:
+                    author, email, date, url = self.scm_info(file, infos)
 
-            if start:
-                if lang == 'cpp':
-                    self.set_errors_cpp(line, index)
-                else:
-                    self.set_errors_java(line, index)
-            else:
-                if start:
-                    m = re.search(r'^\[ERROR\]\s+.*\s+on\s+project\s+(.*?)\s*:', line)
+                    owners = blames.get(file) or {}
 
-                    if m:
-                        self.module_name = m.group(1)
+                    for owner in owners.values():
+                        if owner:
+                            author = owner['author']
+                            email = owner['email']
+                            date = owner['date']
 
-                        found = False
+                            break
 
-                        if self.errors:
-                            for file, info in self.errors.items():
-                                if info['module'] == self.module_name:
-                                    found = True
+                    self.errors[file]['author'] = author
+                    self.errors[file]['email'] = email
+                    self.errors[file]['date'] = date
+                    self.errors[file]['url'] = url
+                    self.errors[file]['owners'] = owners
 
-                                    break
+        return self.errors
 
-                        if not found:
-                            file = None
-                            lineno = None
-                            message = [line]
+    def puts_errors(self):
+        if self.errors:
+            errors = collections.OrderedDict()
 
-                            for i in range(500):
-                                tmpindex = index + i + 1
+            for file in self.errors:
+                if file:
+                    for lineno in self.errors[file]['message']:
+                        author, date = self.owner(file, lineno)[:2]
 
-                                if tmpindex >= len(self.lines):
-                                    break
-                                end
+                        if author is None:
+                            author = ''
 
-                                tmpline = self.lines[tmpindex]
+                        if author not in errors:
+                            errors[author] = {}
 
-                                if tmpline is None:
-                                    continue
+                        errors[author][file] = date
 
-                                tmpline = tmpline.strip()
+            if errors:
+                print()
+                print('*' * 60)
 
-                                if re.search(r'^\[ERROR\]\s+->\s+\[Help\s+.*\]$', tmpline):
-                                    break
+                for author in sorted(list(errors.keys())):
+                    print('%s:' % author)
+                    print('=' * 30)
 
-                                m = re.search(r'^\[ERROR\]\s+.*\s+in\s+(.*?)\/target\/', tmpline)
+                    for file in sorted(list(errors[author].keys())):
+                        print('  %s, %s' % (os.path.abspath(file), errors[author][file]))
 
-                                if m:
-                                    file = os.path.abspath(m.group(1))
+                    print()
 
-                                if re.search(r'^\[INFO\]\s+Building\s+', tmpline):
-                                    break
+    def sendmail(self):
+        if self.errors:
+            errors = collections.OrderedDict()
 
-                                message.append(tmpline)
+            admin_addrs = None
 
-                            if not self.errors:
-                                self.errors = collections.OrderedDict()
+            if os.environ.get('SENDMAIL.ADMIN'):
+                admin_addrs = __string__.split(os.environ.get('SENDMAIL.ADMIN'))
 
-                            if file not in self.errors:
-                                self.errors[file] = {
-                                    'module'  : self.module_name,
-                                    'logs'    : None,
-                                    'message' : collections.OrderedDict()
-                                }
+            for file in self.errors:
+                if file:
+                    # error lines of the file grouped by the owner of each line
+                    owners = []
 
-                            self.errors[file]['message'][lineno] = message
+                    for lineno in self.errors[file]['message']:
+                        date, email = self.owner(file, lineno)[1:]
 
-                        self.module_name = None
+                        if not email:
+                            email = admin_addrs
 
-                        continue
+                        if not email:
+                            continue
 
-        if self.errors:
-            for file in list(self.errors.keys()):
-                if file:
-                    found = False
+                        for owner in owners:
+                            if owner[0] == email:
+                                owner[2].append(lineno)
 
-                    tmp_file = __os__.normpath(file)
+                                break
+                        else:
+                            owners.append([email, date, [lineno]])
 
-                    for name in ('target/', 'output/'):
-                        if name in tmp_file:
-                            found = True
+                    for email, date, linenos in owners:
+                        if email not in errors:
+                            errors[email] = []
 
-                            break
+                        message = []
+                        message.append('<font color="red"><strong>%s(%s)</strong></font>:' % (os.path.abspath(file), date))
+                        message.append('-' * 60)
 
-                    if found:
-                        del self.errors[file]
+                        for lineno in linenos:
+                            message.append('  lineno: %s' % lineno)
 
-                        continue
+                            for line in self.errors[file]['message'][lineno]:
+                                message.append('  %s' % line)
 
-                    artifact_id = self.artifactid(file)
+                            message.append('')
 
-                    if artifact_id:
-                        logs_info = logs.get(artifact_id)
+                        message.append('')
 
-                        if logs_info:
-                            self.errors[file]['logs'] = self.lines[logs_info[0]:logs_info[-1]]
+                        errors[email].append([message, self.errors[file]['logs']])
 
-                    author, email, date, url = self.scm_info(file)
+            for email, info in errors.items():
+                with __os__.tmpdir(tempfile.mkdtemp(), False) as tmpdir:
+                    lines = []
+                    logs = []
 
-                    self.errors[file]['author'] = author
-                    self.errors[file]['email'] = email
-                    self.errors[file]['date'] = date
-                    self.errors[file]['url'] = url
+                    for message, log in info:
+                        lines += message
 
-        return self.errors
+                        if log:
+                            if logs:
+                                logs.append('')
+                                logs.append('=' * 60)
 
-    def set_errors_java(self, line, index):
-        m = re.search(r'\s+Compiling\s+\d+\s+source\s+(file|files)\s+to\s+(.*)\/target\/', line)
+                            logs += log
 
-        if m:
-            self.module_home = m.group(2)
+                    attaches = None
 
-            return True
+                    if logs:
+                        try:
+                            with open('build.log', 'w', encoding = 'utf-8') as f:
+                                f.write('\n'.join(logs))
 
-        m = re.search(r'^\[ERROR\]\s+(.+):\[(\d+),\d+\]', line)
+                            attaches = {'build.log': 'build.log'}
+                        except Exception as e:
+                            print(e)
 
-        if m:
-            if self.module_home and os.path.isdir(self.module_home):
-                with __os__.chdir(self.module_home) as chdir:
-                    file = os.path.abspath(m.group(1))
-                    lineno = int(m.group(2))
-                    message = [line]
+                    if os.environ.get('BUILD_URL'):
+                        console_url = __os__.join(os.environ['BUILD_URL'], 'console')
 
-                    for i in range(10):
-                        tmpindex = index + i + 1
+                        lines.append('')
+                        lines.append('详细信息: <a href="%s">%s</a>' % (console_url, console_url))
+                        lines.append('')
 
-                        if tmpindex >= len(self.lines):
-                            break
+                        smtp.sendmail(self.notification, email, admin_addrs, '<br>\n'.join(lines))
+                    else:
+                        smtp.sendmail(self.notification, email, admin_addrs, '<br>\n'.join(lines), attaches)
 
-                        tmpline = self.lines[tmpindex]
+    def artifactid(self, path):
+        return pom.index.get(path).artifactid(path)
 
-                        if tmpline is None:
-                            continue
+    def artifactid_prefix(self, artifactid):
+        return pom.prefix(artifactid)
 
-                        tmpline = tmpline.strip()
+    def retry_compile(self, cmdline, lang):
+        if os.path.isfile('pom.xml'):
+            self.errors = None
+            self.lines = command.capture()
+            self.analyzer = analyzer(lang)
 
-                        if re.search(r'^\[INFO\]\s+\d+(error|errors)$', tmpline):
-                            break
+            cmd = command.command()
 
-                        if re.search(r'^\[INFO\]', tmpline):
-                            continue
+            for line in cmd.command(cmdline, tee = self.logfile()):
+                self.lines.append(line)
+                self.analyzer.feed(line)
 
-                        message.append(tmpline)
+                print(line)
 
-                    if not self.errors:
-                        self.errors = collections.OrderedDict()
+            if not cmd.result():
+                return False
 
-                    if file not in self.errors:
-                        self.errors[file] = {
-                            'module'  : self.module_name,
-                            'logs'    : None,
-                            'message' : collections.OrderedDict()
-                        }
+            status = self.analyzer.status
 
-                    self.errors[file]['message'][lineno] = message
+            if status:
+                self.lines = []
 
                 return True
             else:
-                return False
+                self.set_errors(lang)
+                self.puts_errors()
+                self.sendmail()
 
-        m = re.search(r'^Tests\s+run\s*:\s*(\d+)\s*,\s*Failures\s*:\s*(\d+)\s*,\s*Errors\s*:\s*(\d+)\s*,\s*Skipped\s*:\s*(\d+)\s*,\s*.*FAILURE.*\s*-\s*in\s+', line)
+                return False
+        else:
+            return False
 
-        if m:
-            if self.module_home and os.path.isdir(self.module_home):
-                with __os__.chdir(self.module_home) as chdir:
-                    if int(m.group(2)) > 0 or int(m.group(3)):
-                        filename = '%s.java' % m.string[m.end():].replace('.', '/')
-                        file = None
+    # failed modules of the reactor and the modules depending on them, in
+    # build order
+    #
+    #   artifactid: path relative to the working directory, for -pl
+    def retry_modules(self):
+        if self.analyzer is None:
+            self.analyzer = analyzer()
 
-                        if os.path.isfile(os.path.join('src/test/java', filename)):
-                            file = os.path.abspath(os.path.join('src/test/java', filename))
-                        else:
-                            for name in glob.iglob(os.path.join('**', filename), recursive = True):
-                                file = os.path.abspath(name)
+            for line in self.lines:
+                self.analyzer.feed(line)
 
-                                if __os__.normpath(name).startswith('src/'):
-                                    break
+        modules = pom.reactor(self.path)
 
-                        if file:
-                            lineno = None
-                            message = [line]
+        # reactor summary shows <name>, or artifactId without it
+        names = {}
 
-                            for i in range(10):
-                                tmpindex = index + i + 1
+        for artifactid, info in modules.items():
+            names[info['name'] or artifactid] = artifactid
 
-                                if tmpindex >= len(self.lines):
-                                    break
+        failed = []
 
-                                tmpline = self.lines[tmpindex]
+        for name, status in self.analyzer.reactor.items():
+            if status in ('FAILURE', 'SKIPPED'):
+                if name in names:
+                    failed.append(names[name])
 
-                                if tmpline is None:
-                                    continue
+        paths = collections.OrderedDict()
 
-                                tmpline = tmpline.strip()
+        for artifactid in pom.dependents(pom.dependencies(modules), failed):
+            paths[artifactid] = os.path.relpath(modules[artifactid]['path'], os.getcwd())
 
-                                m = re.search(r'^at\s+.*\(#{File.basename(filename)}\s*:\s*(\d+)\)$', tmpline)
+        return paths
 
-                                if m:
-                                    lineno = int(m.group(1))
-                                    message.append(tmpline)
+    # MAVEN_LOG_HOME: archive the full build output as compressed log files
+    def logfile(self):
+        if os.environ.get('MAVEN_LOG_HOME'):
+            return os.path.join(os.environ['MAVEN_LOG_HOME'], '%s_%s.log.gz' % (__os__.tmpfilename(), os.path.basename(os.getcwd())))
+        else:
+            return None
 
-                                    break
+    # (author, date, email) of the error line, the blamed commit of the line
+    # or the last commit of the file
+    def owner(self, file, lineno):
+        info = self.errors[file]
 
-                                message.append(tmpline)
+        owner = (info.get('owners') or {}).get(lineno)
 
-                            if not self.errors:
-                                self.errors = collections.OrderedDict()
+        if owner and owner['email']:
+            return (owner['author'], owner['date'], owner['email'])
 
-                            if file not in self.errors:
-                                self.errors[file] = {
-                                    'module'  : self.module_name,
-                                    'logs'    : None,
-                                    'message' : collections.OrderedDict()
-                                }
+        return (info.get('author'), info.get('date'), info.get('email'))
 
-                            self.errors[file]['message'][lineno] = message
+    def scm_info(self, file, infos = None):
+        author = None
+        email = None
+        date = None
+        url = None
 
-                return True
+        if file:
+            if infos is not None:
+                info = infos.get(file)
             else:
-                return False
-
-        return None
-
-    def set_errors_cpp(self, line, index):
-        m = re.search(r'\s+\/bin\/sh\s+-c\s+cd\s+(.*?)\s+&&\s+', line)
-
-        if m:
-            self.module_home = m.group(1)
-
-            return True
+                info = git.info(file)
 
-        m = re.search(r'\s+\/Fo(.*?)\\target\\objs\\.*\.obj\s+-c\s+', line)
-
-        if m:
-            self.module_home = m.group(1)
+            if info:
+                author = info['author']
+                email = info['email']
+                date = info['date']
+                url = info.get('url')
 
-            return True
+        return (author, email, date, url)
 
-        # compile
-        #   linux   : r':\s*(\d+)\s*:\s*(\d+)\s*:\s*\w*\s*(error|错误)\s*\w*\d*(:|：)'
-        #   solaris : r',\s*第\s*(\d+)\s*行:\s*(error|错误)\s*,/'
-        #   windows : r'\((\d+)\)\s*:\s*\w*\s*(error|错误)\s*\w*\d*(:|：)', r':\s*(\d+)\s*:\s*\w*\s*(error|错误)\s*\w*\d*(:|：)'
-        m = (re.search(r':\s*(\d+)\s*:\s*(\d+)\s*:\s*\w*\s*(error|错误)\s*\w*\d*(:|：)', line) or
-            re.search(r',\s*第\s*(\d+)\s*行:\s*(error|错误)\s*,', line) or
-            re.search(r'\((\d+)\)\s*:\s*\w*\s*(error|错误)\s*\w*\d*(:|：)', line) or
-            re.search(r':\s*(\d+)\s*:\s*\w*\s*(error|错误)\s*\w*\d*(:|：)', line))
+# maven output, parsed line by line while the build runs
+#
+#   status  : True/False/None, BUILD SUCCESS/FAILURE
+#   logs    : module -> [start, end] index of its lines
+#   reactor : module -> SUCCESS/FAILURE/SKIPPED of the reactor summary
+#   errors  : file -> module, logs, message (lineno -> lines)
+#
+#   lines = analyzer('cpp')
+#
+#   for line in cmd.command('mvn install'):
+#       if not lines.feed(line):
+#           print(line)
+#
+#   errors = lines.finish()
+class analyzer:
+    def __init__(self, lang = None):
+        self.lang = lang
+        self.status = None
+
+        self.index = -1
+        self.start = False
+        self.summary = False
+        self.reactor_summary = False
 
-        if m:
-            if self.module_home and os.path.isdir(self.module_home):
-                with __os__.chdir(self.module_home) as chdir:
-                    file = m.string[:m.start()].strip()
-                    lineno = int(m.group(1))
-                    message = [line]
+        self.module_name = None
+        self.module_home = os.getcwd()
 
-                    m = re.search(r'^"(.*)"$', file)
+        self.logs = {}
+        self.reactor = collections.OrderedDict()
+        self.errors = collections.OrderedDict()
 
-                    if m:
-                        file = m.group(1).strip()
+        # look-ahead: errors still collecting the lines that follow
+        self.pending = []
 
-                    if file:
-                        file = os.path.abspath(file)
+        # look-behind: the lines before a link error
+        self.recent = collections.deque(maxlen = 500)
 
-                        if not self.errors:
-                            self.errors = collections.OrderedDict()
+    # True if the line is noise on the console
+    def feed(self, line):
+        self.index += 1
 
-                        if file not in self.errors:
-                            self.errors[file] = {
-                                'module'  : self.module_name,
-                                'logs'    : None,
-                                'message' : collections.OrderedDict()
-                            }
+        if line is None:
+            return True
 
-                        self.errors[file]['message'][lineno] = message
+        line = line.strip()
 
-                return True
-            else:
-                return False
+        if self.pending:
+            self.pending = [x for x in self.pending if self.collect(x, line)]
 
-        # link
-        #   linux   : r'collect2\s*:\s*ld\s+', r':\s*(\d+)\s*:\s*undefined\s+reference\s+to\s+'
-        #   solaris : r'ld\s*:\s*.*:\s*symbol\s+referencing\s+errors\.', r'\s+target\/objs\/(.*?)\.o$'
-        #   windows : r'\s*:\s*fatal\s+error\s+LNK\d+\s*:', r':\s*error\s+LNK\d+\s*:\s*unresolved\s+external\s+symbol\s+'
-        m = (re.search(r'collect2\s*:\s*ld\s+', line) or
-            re.search(r'ld\s*:\s*.*:\s*symbol\s+referencing\s+errors\.', line) or
-            re.search(r'\s*:\s*fatal\s+error\s+LNK\d+\s*:', line))
+        self.set_status(line)
+        self.set_module(line)
 
-        if m:
-            if re.search(r'collect2\s*:\s*ld\s+', line):
-                osname = 'linux'
-            elif re.search(r'ld\s*:\s*.*:\s*symbol\s+referencing\s+errors\.', line):
-                osname = 'solaris'
-            elif re.search(r'\s*:\s*fatal\s+error\s+LNK\d+\s*:', line):
-                osname = 'windows'
+        if self.start:
+            if self.lang == 'cpp':
+                self.set_errors_cpp(line)
             else:
-                osname = None
+                self.set_errors_java(line)
 
-            if self.module_home and os.path.isdir(self.module_home):
-                with __os__.chdir(self.module_home) as chdir:
-                    file = os.getcwd()
-                    lineno = None
-                    message = []
+        self.recent.append(line)
 
-                    for i in range(500):
-                        tmpindex = index - i - 1
+        return self.ignore(line)
 
-                        if tmpindex < 0:
-                            break
+    def finish(self):
+        for x in self.pending:
+            self.complete(x)
 
-                        tmpline = self.lines[tmpindex]
+        self.pending = []
 
-                        if tmpline is None:
-                            continue
+        if self.errors:
+            return self.errors
+        else:
+            return None
 
-                        tmpline = tmpline.strip()
+    def ignore(self, line):
+        if RE_COMMAND.search(line):
+            return False
 
-                        if re.search(r':\s*link\s+\(default-link\)\s+@', tmpline):
-                            break
+        if RE_COMMAND_CWD.search(line):
+            return False
 
-                        if ((osname == 'linux' and re.search(r':\s*(\d+)\s*:\s*undefined\s+reference\s+to\s+', tmpline)) or
-                            (osname == 'solaris' and re.search(r'\s+target\/objs\/(.*?)\.o$', tmpline)) or
-                            (osname == 'windows' and re.search(r':\s*error\s+LNK\d+\s*:\s*unresolved\s+external\s+symbol\s+', tmpline))):
-                            message.append(tmpline)
+        if RE_REACTOR_SUMMARY.search(line):
+            self.summary = True
 
-                    if not self.errors:
-                        self.errors = collections.OrderedDict()
+        if self.summary:
+            if RE_FINAL_MEMORY.search(line):
+                self.summary = False
 
-                    if file not in self.errors:
-                        self.errors[file] = {
-                            'module'  : self.module_name,
-                            'logs'    : None,
-                            'message' : collections.OrderedDict()
-                        }
+            return False
+        else:
+            if RE_SEPARATOR.search(line):
+                return False
+            elif RE_BUILDING.search(line):
+                if RE_BUILDING_PACKAGE.search(line):
+                    return True
+                else:
+                    return False
+            elif RE_BUILD_RESULT.search(line):
+                return False
+            elif RE_ERROR.search(line):
+                return False
+            elif 'http://' in line:
+                return True
+            elif RE_EXEC_ERROR.search(line):
+                return False
+            elif RE_MESSAGE_ERROR.search(line):
+                if 'following dependencies:' in line:
+                    return True
+                else:
+                    return False
+            else:
+                return True
 
-                    message.reverse()
+    def set_status(self, line):
+        m = RE_BUILD_RESULT.search(line)
 
-                    self.errors[file]['message'][lineno] = message
+        if m:
+            if m.group(1) == 'SUCCESS':
+                if self.status is None:
+                    self.status = True
+            else:
+                self.status = False
 
-                return True
+        if RE_REACTOR_SUMMARY.search(line):
+            self.reactor_summary = True
+        elif self.reactor_summary:
+            if m:
+                self.reactor_summary = False
             else:
-                return False
+                m = RE_REACTOR_MODULE.search(line)
 
-        return None
+                if m:
+                    self.reactor[m.group(1)] = m.group(2)
 
-    def puts_errors(self):
-        if self.errors:
-            errors = collections.OrderedDict()
+    def set_module(self, line):
+        index = self.index
 
-            for file in self.errors:
-                if file:
-                    author = self.errors[file]['author']
+        if RE_BUILDING.search(line) and not RE_BUILDING_PACKAGE.search(line):
+            self.start = True
 
-                    if author is None:
-                        author = ''
+            if self.module_name:
+                if index > 1:
+                    self.logs[self.module_name][-1] = index - 2
+                else:
+                    self.logs[self.module_name][-1] = index
 
-                    if author not in errors:
-                        errors[author] = {}
+            self.module_name = RE_BUILDING.sub('', line).split()[0]
 
-                    errors[author][file] = self.errors[file]['date']
+            if index > 0:
+                self.logs[self.module_name] = [index - 1, -1]
+            else:
+                self.logs[self.module_name] = [index, -1]
 
-            if errors:
-                print()
-                print('*' * 60)
+            return True
 
-                for author in sorted(list(errors.keys())):
-                    print('%s:' % author)
-                    print('=' * 30)
+        if RE_BUILD_RESULT.search(line):
+            self.start = False
 
-                    for file in sorted(list(errors[author].keys())):
-                        print('  %s, %s' % (os.path.abspath(file), errors[author][file]))
+            if self.module_name:
+                if self.logs[self.module_name][-1] == -1:
+                    if index > 0:
+                        self.logs[self.module_name][-1] = index - 1
+                    else:
+                        self.logs[self.module_name][-1] = index
 
-                    print()
+                self.module_name = None
 
-    def sendmail(self):
-        if self.errors:
-            errors = collections.OrderedDict()
+            return True
 
-            admin_addrs = None
+        return False
 
-            if os.environ.get('SENDMAIL.ADMIN'):
-                admin_addrs = __string__.split(os.environ.get('SENDMAIL.ADMIN'))
+    def set_errors_java(self, line):
+        m = RE_JAVA_COMPILING.search(line)
 
-            for file in self.errors:
-                if file:
-                    email = self.errors[file]['email']
+        if m:
+            self.module_home = m.group(2)
 
-                    if not email:
-                        email = admin_addrs
+            return True
 
-                    if email:
-                        if email not in errors:
-                            errors[email] = []
+        m = RE_JAVA_ERROR.search(line)
 
-                        message = []
-                        message.append('<font color="red"><strong>%s(%s)</strong></font>:' % (os.path.abspath(file), self.errors[file]['date']))
-                        message.append('-' * 60)
+        if m:
+            if self.module_home and os.path.isdir(self.module_home):
+                file = self.abspath(m.group(1))
+                lineno = int(m.group(2))
+                message = [line]
 
-                        for lineno, msg in self.errors[file]['message'].items():
-                            message.append('  lineno: %s' % lineno)
+                self.add_error(file, lineno, message)
 
-                            for line in msg:
-                                message.append('  %s' % line)
+                self.pending.append({
+                    'type'    : 'java',
+                    'file'    : file,
+                    'lineno'  : lineno,
+                    'message' : message,
+                    'lines'   : 10
+                })
 
-                            message.append('')
+                return True
+            else:
+                return False
 
-                        message.append('')
+        m = RE_JAVA_TEST.search(line)
 
-                        errors[email].append([message, self.errors[file]['logs']])
+        if m:
+            if self.module_home and os.path.isdir(self.module_home):
+                if int(m.group(2)) > 0 or int(m.group(3)):
+                    file = sources.get(self.module_home).find(m.string[m.end():].strip())
 
-            for email, info in errors.items():
-                with __os__.tmpdir(tempfile.mkdtemp(), False) as tmpdir:
-                    lines = []
-                    logs = []
+                    if file:
+                        self.pending.append({
+                            'type'    : 'test',
+                            'file'    : file,
+                            'lineno'  : None,
+                            'message' : [line],
+                            'lines'   : 10,
+                            're'      : re.compile(r'^at\s+.*\(%s\s*:\s*(\d+)\)$' % re.escape(os.path.basename(file)))
+                        })
 
-                    for message, log in info:
-                        lines += message
+                return True
+            else:
+                return False
 
-                        if log:
-                            if logs:
-                                logs.append('')
-                                logs.append('=' * 60)
+        return None
 
-                            logs += log
+    def set_errors_cpp(self, line):
+        m = RE_CPP_SH.search(line) or RE_CPP_FO.search(line)
 
-                    attaches = None
+        if m:
+            self.module_home = m.group(1)
 
-                    if logs:
-                        try:
-                            with open('build.log', 'w', encoding = 'utf-8') as f:
-                                f.write('\n'.join(logs))
+            return True
 
-                            attaches = {'build.log': 'build.log'}
-                        except Exception as e:
-                            print(e)
+        m = (RE_CPP_ERROR_LINUX.search(line) or
+            RE_CPP_ERROR_SOLARIS.search(line) or
+            RE_CPP_ERROR_WINDOWS.search(line) or
+            RE_CPP_ERROR.search(line))
 
-                    if os.environ.get('BUILD_URL'):
-                        console_url = __os__.join(os.environ['BUILD_URL'], 'console')
+        if m:
+            if self.module_home and os.path.isdir(self.module_home):
+                file = m.string[:m.start()].strip()
+                lineno = int(m.group(1))
 
-                        lines.append('')
-                        lines.append('详细信息: <a href="%s">%s</a>' % (console_url, console_url))
-                        lines.append('')
+                m = re.search(r'^"(.*)"$', file)
 
-                        smtp.sendmail(self.notification, email, admin_addrs, '<br>\n'.join(lines))
-                    else:
-                        smtp.sendmail(self.notification, email, admin_addrs, '<br>\n'.join(lines), attaches)
+                if m:
+                    file = m.group(1).strip()
 
-    def artifactid(self, path):
-        if os.path.isfile(path):
-            return self.artifactid(os.path.dirname(path))
-        elif os.path.isdir(path):
-            if os.path.isfile(os.path.join(path, 'pom.xml')):
-                try:
-                    tree = etree.parse(os.path.join(path, 'pom.xml'))
-                    namespace = tree.getroot().nsmap
-
-                    e = tree.find('/artifactId', namespace)
-
-                    if e is not None:
-                        return self.artifactid_prefix(e.text.strip())
-                    else:
-                        return None
-                except:
-                    return None
-            else:
-                if os.path.dirname(path) == path:
-                    return None
-                else:
-                    return self.artifactid(os.path.dirname(path))
-        else:
-            return None
+                if file:
+                    self.add_error(self.abspath(file), lineno, [line])
 
-    def artifactid_prefix(self, artifactid):
-        if '${prefix}' in artifactid:
-            if __os__.osname() in ('windows', 'windows-x64'):
-                return artifactid.replace('${prefix}', '')
+                return True
             else:
-                return artifactid.replace('${prefix}', 'lib')
+                return False
+
+        if RE_CPP_LINK_LINUX.search(line):
+            osname = 'linux'
+        elif RE_CPP_LINK_SOLARIS.search(line):
+            osname = 'solaris'
+        elif RE_CPP_LINK_WINDOWS.search(line):
+            osname = 'windows'
         else:
-            return artifactid
+            osname = None
 
-    def retry_compile(self, cmdline, lang):
-        if os.path.isfile('pom.xml'):
-            self.errors = None
-            self.lines = []
+        if osname:
+            if self.module_home and os.path.isdir(self.module_home):
+                message = []
 
-            status = None
+                for tmpline in reversed(self.recent):
+                    if RE_CPP_LINK_START.search(tmpline):
+                        break
 
-            cmd = command.command()
-
-            for line in cmd.command(cmdline):
-                self.lines.append(line)
+                    if RE_CPP_LINK_SYMBOLS[osname].search(tmpline):
+                        message.append(tmpline)
 
-                status = self.validate(status, line)
+                message.reverse()
 
-                print(line)
+                self.add_error(self.abspath('.'), None, message)
 
-            if not cmd.result():
+                return True
+            else:
                 return False
 
-            if status:
-                self.lines = []
+        return None
 
-                return True
-            else:
-                self.set_errors(lang)
-                self.puts_errors()
-                self.sendmail()
+    # False once the error has all of its lines
+    def collect(self, pending, line):
+        pending['lines'] -= 1
 
+        if pending['type'] == 'java':
+            if RE_JAVA_ERROR_COUNT.search(line):
                 return False
+
+            if not line.startswith('[INFO]'):
+                pending['message'].append(line)
         else:
-            return False
+            pending['message'].append(line)
 
-    def retry_modules(self):
-        modules = {}
+            m = pending['re'].search(line)
 
-        start = False
+            if m:
+                pending['lineno'] = int(m.group(1))
 
-        for line in self.lines:
-            line = line.strip()
+                self.complete(pending)
 
-            if re.search(r'^\[INFO\]\s+Reactor\s+Summary:$', line):
-                start = True
+                return False
 
-            if re.search(r'^\[INFO\]\s+BUILD\s+(SUCCESS|FAILURE)$', line):
-                start = False
+        if pending['lines'] > 0:
+            return True
 
-            if start:
-                m = re.search(r'^\[INFO\]\s+(.*?)\s+\.+\s*(FAILURE|SKIPPED)', line)
+        self.complete(pending)
 
-                if m:
-                    modules[m.group(1)] = None
+        return False
 
-        if modules:
-            paths = self.artifactid_paths(self.path)
+    def complete(self, pending):
+        if pending['type'] == 'test':
+            self.add_error(pending['file'], pending['lineno'], pending['message'])
 
-            for module_name in list(modules.keys()):
-                path = paths.get(module_name)
+    def add_error(self, file, lineno, message):
+        if file not in self.errors:
+            self.errors[file] = {
+                'module'  : self.module_name,
+                'logs'    : None,
+                'message' : collections.OrderedDict()
+            }
 
-                if path:
-                    modules[module_name] = os.path.relpath(path, os.getcwd())
-                else:
-                    del modules[module_name]
+        self.errors[file]['message'][lineno] = message
 
-        return modules
+    def abspath(self, path):
+        return os.path.abspath(os.path.join(self.module_home, path))
 
-    def retry_pom(self, modules, template):
-        try:
-            tree = etree.parse(template)
-            namespace = tree.getroot().nsmap
+# fully qualified class name -> java source file of a module, built on the
+# first lookup and kept for the rest of the run
+#
+#   sources.get(module_home).find('com.zte.FooTest')
+class sources:
+    indexes = {}
 
-            for e in tree.findall('/artifactId', namespace):
-                e.text = '%s-tmp' % e.text.strip()
+    def __init__(self, path):
+        self.path = path
+        self.files = None
 
-            for e in tree.findall('//modules', namespace):
-                for element in e.findall('module', namespace):
-                    e.remove(element)
+    @staticmethod
+    def get(path):
+        path = os.path.abspath(path)
 
-            for e in tree.findall('/build', namespace):
-                tree.getroot().remove(e)
+        if path not in sources.indexes:
+            sources.indexes[path] = sources(path)
 
-            e = tree.find('/modules', namespace)
+        return sources.indexes[path]
 
-            for module, path in modules.items():
-                element = etree.Element('module')
-                element.text = __os__.join('..', path)
-                e.append(element)
+    # src/test/java first, then the files under src/, then any other
+    def find(self, classname):
+        if self.files is None:
+            self.load()
 
-            tree.write('pom.xml', encoding='utf-8', pretty_print=True, xml_declaration=True)
-        except:
-            pass
+        filename = '%s.java' % classname.split('$')[0].replace('.', '/')
 
-    def scm_info(self, file):
-        author = None
-        email = None
-        date = None
-        url = None
+        if filename in self.files:
+            return os.path.join(self.path, self.files[filename])
 
-        if file:
-            info = git.info(file)
+        return None
 
-            if info:
-                author = info['author']
-                email = info['email']
-                date = info['date']
-                url = info['url']
+    # relative file -> best file of the module for every package path
+    def load(self):
+        self.files = {}
 
-        return (author, email, date, url)
+        for dirpath, dirnames, filenames in os.walk(self.path):
+            dirnames[:] = [x for x in dirnames if not x.startswith('.')]
+
+            for filename in filenames:
+                if not filename.endswith('.java'):
+                    continue
+
+                name = __os__.normpath(os.path.relpath(os.path.join(dirpath, filename), self.path))
+                parts = name.split('/')
+
+                for i in range(len(parts)):
+                    key = '/'.join(parts[i:])
+
+                    if key not in self.files or self.rank(self.files[key], key) > self.rank(name, key):
+                        self.files[key] = name
+
+    def rank(self, name, key):
+        if name == 'src/test/java/%s' % key:
+            return 0
+        elif name.startswith('src/'):
+            return 1
+        else:
+            return 2
+
+RE_COMMAND = re.compile(r'^\$\s+')
+RE_COMMAND_CWD = re.compile(r'^in\s+\(.*\)$')
+RE_SEPARATOR = re.compile(r'^\[INFO\]\s+-+$')
+RE_BUILDING = re.compile(r'^\[INFO\]\s+Building\s+')
+RE_BUILDING_PACKAGE = re.compile(r'^\[INFO\]\s+Building\s+(jar|war|zip)\s*:')
+RE_BUILD_RESULT = re.compile(r'^\[INFO\]\s+BUILD\s+(SUCCESS|FAILURE)$')
+RE_REACTOR_SUMMARY = re.compile(r'^\[INFO\]\s+Reactor\s+Summary:$')
+RE_REACTOR_MODULE = re.compile(r'^\[INFO\]\s+(.*?)\s+\.+\s*(SUCCESS|FAILURE|SKIPPED)')
+RE_FINAL_MEMORY = re.compile(r'^\[INFO\]\s+Final\s+Memory:')
+RE_ERROR = re.compile(r'\[(ERROR|EXCEPTION)\]')
+RE_EXEC_ERROR = re.compile(r'\[exec\].*\s+(error|errors)\s+')
+RE_MESSAGE_ERROR = re.compile(r'\:.*\s+(error|errors)\s+')
+
+RE_JAVA_COMPILING = re.compile(r'\s+Compiling\s+\d+\s+source\s+(file|files)\s+to\s+(.*)\/target\/')
+RE_JAVA_ERROR = re.compile(r'^\[ERROR\]\s+(.+):\[(\d+),\d+\]')
+RE_JAVA_ERROR_COUNT = re.compile(r'^\[INFO\]\s+\d+\s*(error|errors)$')
+RE_JAVA_TEST = re.compile(r'^Tests\s+run\s*:\s*(\d+)\s*,\s*Failures\s*:\s*(\d+)\s*,\s*Errors\s*:\s*(\d+)\s*,\s*Skipped\s*:\s*(\d+)\s*,\s*.*FAILURE.*\s*-\s*in\s+')
+
+RE_CPP_SH = re.compile(r'\s+\/bin\/sh\s+-c\s+cd\s+(.*?)\s+&&\s+')
+RE_CPP_FO = re.compile(r'\s+\/Fo(.*?)\\target\\objs\\.*\.obj\s+-c\s+')
+
+# compile
+#   linux   : RE_CPP_ERROR_LINUX
+#   solaris : RE_CPP_ERROR_SOLARIS
+#   windows : RE_CPP_ERROR_WINDOWS, RE_CPP_ERROR
+RE_CPP_ERROR_LINUX = re.compile(r':\s*(\d+)\s*:\s*(\d+)\s*:\s*\w*\s*(error|错误)\s*\w*\d*(:|：)')
+RE_CPP_ERROR_SOLARIS = re.compile(r',\s*第\s*(\d+)\s*行:\s*(error|错误)\s*,')
+RE_CPP_ERROR_WINDOWS = re.compile(r'\((\d+)\)\s*:\s*\w*\s*(error|错误)\s*\w*\d*(:|：)')
+RE_CPP_ERROR = re.compile(r':\s*(\d+)\s*:\s*\w*\s*(error|错误)\s*\w*\d*(:|：)')
+
+# link, the symbols are in the lines before, back to the link goal
+RE_CPP_LINK_LINUX = re.compile(r'collect2\s*:\s*ld\s+')
+RE_CPP_LINK_SOLARIS = re.compile(r'ld\s*:\s*.*:\s*symbol\s+referencing\s+errors\.')
+RE_CPP_LINK_WINDOWS = re.compile(r'\s*:\s*fatal\s+error\s+LNK\d+\s*:')
+RE_CPP_LINK_START = re.compile(r':\s*link\s+\(default-link\)\s+@')
+RE_CPP_LINK_SYMBOLS = {
+    'linux'   : re.compile(r':\s*(\d+)\s*:\s*undefined\s+reference\s+to\s+'),
+    'solaris' : re.compile(r'\s+target\/objs\/(.*?)\.o$'),
+    'windows' : re.compile(r':\s*error\s+LNK\d+\s*:\s*unresolved\s+external\s+symbol\s+')
+}
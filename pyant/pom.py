@@ -0,0 +1,446 @@
+import collections
+import json
+import os
+
+from lxml import etree
+
+from pyant import command, git
+from pyant.builtin import __os__
+
+__all__ = ('index', 'reactor', 'dependencies', 'dependents', 'sort', 'prefix')
+
+# layout of the persisted index entries
+INDEX_VERSION = 4
+
+# pom.xml files of a workspace (the git home, or outside git the outermost
+# directory of the pom.xml chain above), and of the modules they list,
+# persisted in <git dir>/pyant/pom.json and re-parsed only when the mtime of
+# a pom.xml changed
+#
+# the workspace is scanned by the first get() of a process, and again after
+# git.clone/pull/sync/reset/sparse_checkout or index.invalidate(), queries
+# in between are dictionary lookups
+#
+#   dirname (absolute):
+#     mtime        : st_mtime_ns of pom.xml
+#     artifactid   : <artifactId>
+#     name         : <name>
+#     parent       : artifactid of the parent pom
+#     parentpath   : dirname of the parent <relativePath> (../pom.xml by
+#                    default), None if empty
+#     modules      : dirnames of the sub modules
+#     dependencies : artifactids of the parent, dependencies and plugins
+#     directory    : <build><directory>
+#     cleanplugin  : maven-clean-plugin anywhere (plugins, pluginManagement,
+#                    profiles)
+#     profiles     : a <profile> with its own <build> or <modules>
+#
+#   poms = pom.index.get('.')
+#   poms.artifactid('code/foo/src/main/java/Foo.java')
+class index:
+    indexes = {}
+
+    # absolute path -> index, filled by get()
+    paths = {}
+
+    # bumped by invalidate()
+    generation = 0
+
+    # (generation, git.CHANGES) of paths
+    paths_generation = None
+
+    def __init__(self, home):
+        self.home = home
+        self.poms = {}
+
+        # (generation, git.CHANGES) of the last refresh()
+        self.refreshed = None
+
+        if git.home(home) == home:
+            self.file = os.path.join(git.git_dir(home), 'pyant', 'pom.json')
+        else:
+            self.file = None
+
+        self.load()
+
+    @staticmethod
+    def get(path = None):
+        path = os.path.abspath(path or '.')
+        generation = (index.generation, git.CHANGES)
+
+        if index.paths_generation != generation:
+            index.paths = {}
+            index.paths_generation = generation
+
+            ROOTS.clear()
+
+        poms = index.paths.get(path)
+
+        if poms is None:
+            dirname = path
+
+            while not os.path.isdir(dirname) and os.path.dirname(dirname) != dirname:
+                dirname = os.path.dirname(dirname)
+
+            home = git.home(dirname) or pom_root(dirname)
+
+            if home not in index.indexes:
+                index.indexes[home] = index(home)
+
+            poms = index.paths[path] = index.indexes[home]
+
+        if poms.refreshed != generation:
+            poms.refresh()
+
+        return poms
+
+    # the working trees changed other than through git.clone/pull/sync/
+    # reset/sparse_checkout (git checkout, copied sources)
+    @staticmethod
+    def invalidate():
+        index.generation += 1
+
+    # directory of the nearest pom.xml at or above path
+    def pom_dir(self, path):
+        path = os.path.abspath(path)
+
+        while True:
+            if path in self.poms:
+                return path
+
+            if os.path.dirname(path) == path:
+                return None
+
+            path = os.path.dirname(path)
+
+    def artifactid(self, path):
+        dirname = self.pom_dir(path)
+
+        if dirname:
+            return self.poms[dirname]['artifactid']
+        else:
+            return None
+
+    # the pom in dirname and its sub modules
+    #
+    #   artifactid:
+    #     path, name, parent, dependencies
+    #     modules : artifactids of the sub modules
+    def reactor(self, dirname, modules = None):
+        if modules is None:
+            modules = collections.OrderedDict()
+
+        entry = self.poms.get(os.path.abspath(dirname))
+
+        if not entry or entry['artifactid'] in modules:
+            return modules
+
+        info = {
+            'path'        : os.path.abspath(dirname),
+            'name'        : entry['name'],
+            'parent'      : entry['parent'],
+            'modules'     : [],
+            'dependencies': entry['dependencies']
+        }
+
+        modules[entry['artifactid']] = info
+
+        for module_path in entry['modules']:
+            if module_path in self.poms:
+                artifactid = self.poms[module_path]['artifactid']
+
+                if artifactid not in modules:
+                    self.reactor(module_path, modules)
+
+                    if artifactid in modules:
+                        info['modules'].append(artifactid)
+
+        return modules
+
+    def refresh(self):
+        self.refreshed = (index.generation, git.CHANGES)
+
+        changed = False
+        dirnames = set()
+
+        # the listed pom.xml files, then the modules they list outside home
+        queue = collections.deque(self.files())
+        seen = set()
+
+        while queue:
+            file = queue.popleft()
+            dirname = os.path.dirname(file)
+
+            if dirname in seen:
+                continue
+
+            seen.add(dirname)
+
+            try:
+                mtime = os.stat(file).st_mtime_ns
+            except OSError:
+                continue
+
+            entry = self.poms.get(dirname)
+
+            if entry is None or entry['mtime'] != mtime:
+                entry = parse(file)
+
+                if entry:
+                    entry['mtime'] = mtime
+                    self.poms[dirname] = entry
+                else:
+                    self.poms.pop(dirname, None)
+
+                changed = True
+
+            if entry:
+                dirnames.add(dirname)
+
+                for module_path in entry['modules']:
+                    if module_path not in seen:
+                        queue.append(os.path.join(module_path, 'pom.xml'))
+
+        for dirname in list(self.poms.keys()):
+            if dirname not in dirnames:
+                del self.poms[dirname]
+
+                changed = True
+
+        if changed:
+            self.save()
+
+    # pom.xml files, tracked and untracked
+    def files(self):
+        files = []
+
+        if self.file:
+            cmd = command.command()
+
+            for index, line in enumerate(cmd.command('git -c core.quotepath=off ls-files --cached --others --exclude-standard -- pom.xml "*/pom.xml"', cwd = self.home)):
+                if index < 2:
+                    continue
+
+                line = line.strip()
+
+                if line:
+                    files.append(os.path.normpath(os.path.join(self.home, line)))
+
+            if cmd.result():
+                return files
+
+            files = []
+
+        for dirpath, dirnames, filenames in os.walk(self.home):
+            dirnames[:] = [x for x in dirnames if not x.startswith('.') and x not in ('target', 'output')]
+
+            if 'pom.xml' in filenames:
+                files.append(os.path.join(dirpath, 'pom.xml'))
+
+        return files
+
+    def load(self):
+        if self.file and os.path.isfile(self.file):
+            try:
+                with open(self.file, encoding = 'utf8') as f:
+                    data = json.load(f)
+
+                if data.get('version') == INDEX_VERSION and data['home'] == self.home:
+                    self.poms = data['poms']
+            except:
+                self.poms = {}
+
+    def save(self):
+        if self.file:
+            try:
+                os.makedirs(os.path.dirname(self.file), exist_ok = True)
+
+                git.write_json(self.file, {'version': INDEX_VERSION, 'home': self.home, 'poms': self.poms})
+            except Exception as e:
+                print(e)
+
+# modules of the aggregator pom in path and its sub modules
+#
+#   artifactid:
+#     path         : module directory
+#     name         : <name>
+#     parent       : artifactid of the parent pom
+#     modules      : artifactids of the sub modules
+#     dependencies : artifactids of the parent, dependencies and plugins
+#
+#   modules = pom.reactor('code/build')
+#   graph = pom.dependencies(modules)
+#
+#   for artifactid in pom.sort(graph):
+#       print(artifactid, modules[artifactid]['path'])
+def reactor(path):
+    return index.get(path).reactor(path)
+
+# artifactid -> artifactids of the reactor it depends on
+def dependencies(modules):
+    graph = collections.OrderedDict()
+
+    for artifactid, info in modules.items():
+        graph[artifactid] = [x for x in info['dependencies'] if x in modules and x != artifactid]
+
+    return graph
+
+# artifactids and the artifactids depending on them, in build order
+def dependents(graph, artifactids):
+    downstream = collections.defaultdict(list)
+
+    for artifactid, depends in graph.items():
+        for x in depends:
+            downstream[x].append(artifactid)
+
+    found = set()
+    queue = [x for x in artifactids if x in graph]
+
+    while queue:
+        artifactid = queue.pop()
+
+        if artifactid not in found:
+            found.add(artifactid)
+            queue += downstream[artifactid]
+
+    return [x for x in sort(graph) if x in found]
+
+# build order, dependencies first, a cycle keeps the order of graph
+def sort(graph):
+    order = []
+    done = set()
+
+    depends = collections.OrderedDict((k, set(v)) for k, v in graph.items())
+
+    while depends:
+        ready = [k for k, v in depends.items() if not (v - done)]
+
+        if not ready:
+            ready = [next(iter(depends))]
+
+        for k in ready:
+            order.append(k)
+            done.add(k)
+
+            del depends[k]
+
+    return order
+
+# ${prefix} of the cpp artifactids
+def prefix(artifactid):
+    if '${prefix}' in artifactid:
+        if __os__.osname() in ('windows', 'windows-x64'):
+            return artifactid.replace('${prefix}', '')
+        else:
+            return artifactid.replace('${prefix}', 'lib')
+    else:
+        return artifactid
+
+# ----------------------------------------------------------
+
+# directory -> pom_root() outside git
+ROOTS = {}
+
+# outermost directory of the pom.xml chain at or above path, path itself
+# without pom.xml
+def pom_root(path):
+    if path in ROOTS:
+        return ROOTS[path]
+
+    root = None
+    dirname = path
+
+    while True:
+        if os.path.isfile(os.path.join(dirname, 'pom.xml')):
+            root = dirname
+        elif root:
+            break
+
+        if os.path.dirname(dirname) == dirname:
+            break
+
+        dirname = os.path.dirname(dirname)
+
+    ROOTS[path] = root or path
+
+    return ROOTS[path]
+
+def parse(file):
+    try:
+        tree = etree.parse(file)
+    except:
+        return None
+
+    root = tree.getroot()
+    namespace = root.nsmap
+
+    artifactid = text(root.find('artifactId', namespace))
+
+    if not artifactid:
+        return None
+
+    dirname = os.path.dirname(os.path.abspath(file))
+
+    entry = {
+        'artifactid'  : artifactid,
+        'name'        : text(root.find('name', namespace)),
+        'parent'      : text(root.find('parent/artifactId', namespace)),
+        'parentpath'  : None,
+        'modules'     : [],
+        'dependencies': [],
+        'directory'   : text(root.find('build/directory', namespace)),
+        'cleanplugin' : False,
+        'profiles'    : False
+    }
+
+    for e in root.findall('.//artifactId', namespace):
+        if text(e) == 'maven-clean-plugin':
+            entry['cleanplugin'] = True
+
+    for e in root.findall('profiles/profile', namespace):
+        if e.find('build', namespace) is not None or e.find('modules', namespace) is not None:
+            entry['profiles'] = True
+
+    if entry['parent']:
+        entry['dependencies'].append(entry['parent'])
+
+        e = root.find('parent/relativePath', namespace)
+
+        if e is None:
+            parent_path = '../pom.xml'
+        else:
+            parent_path = (e.text or '').strip()
+
+        if parent_path:
+            parent_path = os.path.normpath(os.path.join(dirname, parent_path))
+
+            if parent_path.endswith('.xml'):
+                parent_path = os.path.dirname(parent_path)
+
+            entry['parentpath'] = parent_path
+
+    for xpath in ('dependencies/dependency', 'build/plugins/plugin'):
+        for e in root.findall(xpath, namespace):
+            name = text(e.find('artifactId', namespace))
+
+            if name and name not in entry['dependencies']:
+                entry['dependencies'].append(name)
+
+    for e in root.findall('modules/module', namespace):
+        module_path = (e.text or '').strip()
+
+        if module_path:
+            module_path = os.path.normpath(os.path.join(dirname, module_path))
+
+            if module_path.endswith('.xml'):
+                module_path = os.path.dirname(module_path)
+
+            entry['modules'].append(module_path)
+
+    return entry
+
+def text(e):
+    if e is None or not e.text:
+        return None
+
+    return prefix(e.text.strip())
@@ -0,0 +1,266 @@
+import collections
+import os
+import threading
+import time
+
+from pyant import command
+
+__all__ = ('scheduler',)
+
+# jobs   : max parallel jobs, default cpu count
+# limits : max parallel jobs per resource tag, e.g. {'network': 4, 'mvn': 2, 'disk': 1}
+#
+#   sched = scheduler.scheduler(8, {'network': 4})
+#   sched.add('platform', 'git pull', 'U31R22_PLATFORM', 'network')
+#   sched.add('interface', ['git checkout -- .', 'git pull'], 'U31R22_INTERFACE', 'network')
+#   sched.add('build', 'mvn install', 'U31R22_INTERFACE', depends = ('platform', 'interface'))
+#
+#   results = sched.run()
+class scheduler:
+    def __init__(self, jobs = None, limits = None, display = True):
+        if not jobs:
+            jobs = os.cpu_count() or 1
+
+        self.jobs = jobs
+        self.limits = limits or {}
+        self.display = display
+
+        self.queue = collections.OrderedDict()
+
+        self.lock = threading.Lock()
+
+    # cmdlines : cmdline or list of cmdlines (or (cmdline, display_cmd)), run one
+    #            after another in cwd, the job stops at the first failure
+    # tags     : resource tags of the job
+    # depends  : names of the jobs to finish first, the job is skipped if one
+    #            of them fails
+    # after    : names of the jobs to finish first, whatever their result
+    #
+    # a name already queued gets a suffix, name (2), name (3) ..., returns the
+    # name of the job
+    def add(self, name, cmdlines, cwd = None, tags = None, timeout = None, idle_timeout = None, depends = None, after = None):
+        if isinstance(cmdlines, (str, tuple)):
+            cmdlines = [cmdlines]
+
+        if isinstance(tags, str):
+            tags = (tags,)
+
+        if isinstance(depends, str):
+            depends = (depends,)
+
+        if isinstance(after, str):
+            after = (after,)
+
+        if name in self.queue:
+            i = 2
+
+            while '%s (%s)' % (name, i) in self.queue:
+                i += 1
+
+            name = '%s (%s)' % (name, i)
+
+        self.queue[name] = {
+            'name'          : name,
+            'cmdlines'      : list(cmdlines),
+            'cwd'           : cwd,
+            'tags'          : tuple(tags or ()),
+            'timeout'       : timeout,
+            'idle_timeout'  : idle_timeout,
+            'depends'       : tuple(depends or ()),
+            'after'         : tuple(after or ()),
+            'command'       : None
+        }
+
+        return name
+
+    # name:
+    #   status      : True/False
+    #   returncode  : returncode of the last cmdline
+    #   cmdline     : the last cmdline
+    #   time        : seconds
+    #
+    # a skipped job has no result (None)
+    def run(self):
+        results = collections.OrderedDict()
+
+        for name in self.queue:
+            results[name] = None
+
+        pending = list(self.queue.values())
+        self.queue = collections.OrderedDict()
+
+        running = {}
+        finished = set()
+        started = []
+        active = 0
+
+        condition = threading.Condition()
+
+        # the slot and tags are released whatever execute() raises, run()
+        # waits for them otherwise
+        def worker(job):
+            nonlocal active
+
+            result = {
+                'status'    : False,
+                'returncode': None,
+                'cmdline'   : None,
+                'time'      : 0
+            }
+
+            try:
+                result = self.execute(job)
+            except Exception as e:
+                self.puts(job['name'], str(e))
+            finally:
+                with condition:
+                    results[job['name']] = result
+                    finished.add(job['name'])
+
+                    active -= 1
+
+                    for tag in job['tags']:
+                        running[tag] -= 1
+
+                    condition.notify()
+
+        try:
+            with condition:
+                while pending or active:
+                    job = None
+                    skipped = False
+
+                    for x in list(pending):
+                        ready = self.ready(x, results, finished)
+
+                        if ready is None:
+                            pending.remove(x)
+                            finished.add(x['name'])
+
+                            skipped = True
+                        elif ready and not job:
+                            if active < self.jobs and self.runnable(x, running):
+                                job = x
+
+                    if job:
+                        pending.remove(job)
+                        started.append(job)
+
+                        active += 1
+
+                        for tag in job['tags']:
+                            running[tag] = running.get(tag, 0) + 1
+
+                        thread = threading.Thread(target = worker, args = (job,))
+                        thread.daemon = True
+                        thread.start()
+                    elif skipped:
+                        continue
+                    elif active:
+                        condition.wait()
+                    else:
+                        # circular depends
+                        for x in pending:
+                            finished.add(x['name'])
+
+                        pending = []
+        finally:
+            # KeyboardInterrupt or error, the commands run in their own
+            # process groups and outlive the scheduler otherwise
+            for job in started:
+                if job['name'] not in finished:
+                    cmd = job['command']
+
+                    if cmd and cmd.pipe:
+                        command.killpg(cmd.pipe.pid)
+
+        return results
+
+    # True if the depends and after are done, None if one of the depends
+    # failed or was skipped
+    def ready(self, job, results, finished):
+        for name in job['after']:
+            if name in results and name != job['name']:
+                if name not in finished:
+                    return False
+
+        for name in job['depends']:
+            if name in results and name != job['name']:
+                if name not in finished:
+                    return False
+
+                if not results[name] or not results[name]['status']:
+                    return None
+
+        return True
+
+    def runnable(self, job, running):
+        for tag in job['tags']:
+            limit = self.limits.get(tag)
+
+            if limit and running.get(tag, 0) >= limit:
+                return False
+
+        return True
+
+    def execute(self, job):
+        result = {
+            'status'    : True,
+            'returncode': None,
+            'cmdline'   : None,
+            'time'      : 0
+        }
+
+        t = time.time()
+
+        for cmdline in job['cmdlines']:
+            if isinstance(cmdline, tuple):
+                cmdline, display_cmd = cmdline
+            else:
+                display_cmd = None
+
+            cmd = command.command()
+            job['command'] = cmd
+
+            try:
+                for line in cmd.command(cmdline, job['timeout'], job['cwd'], display_cmd = display_cmd, idle_timeout = job['idle_timeout']):
+                    self.puts(job['name'], line)
+            except Exception as e:
+                self.puts(job['name'], str(e))
+
+            result['cmdline'] = display_cmd or cmdline
+
+            if cmd.pipe:
+                result['returncode'] = cmd.pipe.returncode
+
+            if not cmd.result():
+                result['status'] = False
+
+                break
+
+        result['time'] = time.time() - t
+
+        return result
+
+    def puts(self, name, line):
+        if self.display:
+            with self.lock:
+                print('[%s] %s' % (name, line))
+
+    def puts_results(self, results):
+        print()
+        print('*' * 60)
+
+        for name, result in results.items():
+            if result:
+                if result['status']:
+                    status = 'SUCCESS'
+                else:
+                    status = 'FAILURE'
+
+                print('%-40s %-8s %8.1fs' % (name, status, result['time']))
+            else:
+                print('%-40s %-8s' % (name, 'SKIPPED'))
+
+        print('*' * 60)
+        print()